@@ -1,50 +1,157 @@
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from passlib.hash import bcrypt
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from . import crud, models, database
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, models, cache, hashing
+from .deps import get_db
+import asyncio
+import json
+import logging
 import os
+import time
+import redis
+import redis.asyncio as aioredis
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
 
+PRINCIPAL_CHANNEL = "principal:invalidate"
+
+logger = logging.getLogger(__name__)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt.verify(plain_password, hashed_password)
+# Verified token -> user id, and user id -> detached User snapshot.
+_token_cache = cache.TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+_principal_cache = cache.TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+async def verify_password(plain_password, hashed_password):
+    return await hashing.verify_password(plain_password, hashed_password)
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = crud.get_user_by_email(db, email)
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await crud.get_user_by_email(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
+    if hashing.needs_rehash(user.hashed_password):
+        # Upgrade to the configured BCRYPT_ROUNDS; skipped rather than failing the login when busy.
+        # The hash is not part of the cached principal, so nothing is invalidated.
+        try:
+            user.hashed_password = await hashing.hash_password(password)
+            await db.commit()
+        except hashing.HashingPoolSaturated:
+            pass
     return user
 
-def create_access_token(sub: str, expires_delta: timedelta = None):
+def create_access_token(sub: str, expires_delta: timedelta = None, user_id: int = None):
     to_encode = {"sub": sub}
+    if user_id is not None:
+        to_encode["uid"] = user_id
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.SessionLocal)):
+# ---------- PRINCIPAL CACHE ----------
+def _principal_key(user_id: int):
+    return f"principal:{user_id}"
+
+def _principal(user_id: int, email: str):
+    # A plain transient instance: safe to share between requests and sessions.
+    return models.User(id=user_id, email=email)
+
+async def _cache_principal(user_id: int, email: str):
+    user = _principal(user_id, email)
+    _remember_principal(user)
+    await cache.redis_set(_principal_key(user_id), json.dumps({"id": user_id, "email": email}), PRINCIPAL_CACHE_TTL)
+    return user
+
+# Call after committing any change to a user's cached fields (email) or deleting
+# the user. The Redis entry is deleted and the invalidation is published, so every
+# worker drops its in-process copy. A worker that is cut off from Redis when it is
+# published keeps serving its copy for up to PRINCIPAL_CACHE_TTL seconds, and so
+# does every other worker when CACHE_REDIS_URL is unset.
+async def invalidate_principal(user_id: int):
+    _principal_cache.delete(user_id)
+    await cache.redis_delete(_principal_key(user_id))
+    await cache.redis_publish(PRINCIPAL_CHANNEL, user_id)
+
+_invalidations = None
+_invalidation_listener = None
+
+def _invalidation_redis():
+    global _invalidations
+    if _invalidations is None:
+        # Not the cache client: its short socket_timeout would end an idle subscription.
+        _invalidations = aioredis.Redis.from_url(cache.CACHE_REDIS_URL, socket_connect_timeout=1)
+    return _invalidations
+
+async def _listen_for_invalidations():
+    while True:
+        pubsub = _invalidation_redis().pubsub()
+        try:
+            await pubsub.subscribe(PRINCIPAL_CHANNEL)
+            # Anything cached before (re)subscribing may have missed an invalidation.
+            _principal_cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    _principal_cache.delete(int(message["data"]))
+        except redis.RedisError:
+            logger.warning("Principal cache lost its Redis subscription, reconnecting", exc_info=True)
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+def _remember_principal(user):
+    global _invalidation_listener
+    if cache.CACHE_REDIS_URL and (_invalidation_listener is None or _invalidation_listener.done()):
+        _invalidation_listener = asyncio.get_running_loop().create_task(_listen_for_invalidations())
+    _principal_cache.set(user.id, user)
+
+async def _load_principal(db: AsyncSession, user_id: int):
+    user = _principal_cache.get(user_id)
+    if user is not None:
+        return user
+    raw = await cache.redis_get(_principal_key(user_id))
+    if raw:
+        data = json.loads(raw)
+        user = _principal(data["id"], data["email"])
+        _remember_principal(user)
+        return user
+    row = await crud.get_user_by_id(db, user_id)
+    if row is None:
+        return None
+    return await _cache_principal(row.id, row.email)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+    user_id = _token_cache.get(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            email: str = payload.get("sub")
+            if email is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_email(db, email)
+        user_id = payload.get("uid")
+        if user_id is None:
+            # Tokens issued before the uid claim was added.
+            row = await crud.get_user_by_email(db, email)
+            if row is None:
+                raise credentials_exception
+            user_id = row.id
+            await _cache_principal(row.id, row.email)
+        _token_cache.set(token, user_id, ttl=min(PRINCIPAL_CACHE_TTL, payload["exp"] - time.time()))
+    user = await _load_principal(db, user_id)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import redis
+import redis.asyncio as aioredis
+from fastapi import Request, Response
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+# Thread-safe in-process LRU cache whose entries also expire after a TTL.
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# ---------- OPTIONAL REDIS TIER ----------
+# The shared tier is best effort: when CACHE_REDIS_URL is unset or Redis is
+# unreachable, callers fall back to the in-process tier and the database.
+_redis_client = None
+_async_redis_client = None
+
+def _redis_options():
+    return {"socket_timeout": 0.25, "socket_connect_timeout": 0.25}
+
+def get_redis():
+    global _redis_client
+    if not CACHE_REDIS_URL:
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(CACHE_REDIS_URL, **_redis_options())
+    return _redis_client
+
+def get_async_redis():
+    global _async_redis_client
+    if not CACHE_REDIS_URL:
+        return None
+    if _async_redis_client is None:
+        _async_redis_client = aioredis.Redis.from_url(CACHE_REDIS_URL, **_redis_options())
+    return _async_redis_client
+
+async def redis_get(key: str):
+    client = get_async_redis()
+    if client is None:
+        return None
+    try:
+        return await client.get(key)
+    except redis.RedisError:
+        return None
+
+async def redis_set(key: str, value, ttl: float):
+    client = get_async_redis()
+    if client is None:
+        return
+    try:
+        await client.set(key, value, ex=max(1, int(ttl)))
+    except redis.RedisError:
+        pass
+
+async def redis_delete(*keys: str):
+    client = get_async_redis()
+    if client is None or not keys:
+        return
+    try:
+        await client.delete(*keys)
+    except redis.RedisError:
+        pass
+
+async def redis_publish(channel: str, message):
+    client = get_async_redis()
+    if client is None:
+        return
+    try:
+        await client.publish(channel, message)
+    except redis.RedisError:
+        pass
+
+# ---------- RESPONSE CACHE ----------
+# Entries are keyed by owner, generation counters and the full query string.
+# Writes bump the owner (or project) generation after commit, which makes every
+# older entry unreachable; they then simply age out. Without CACHE_REDIS_URL the
+# generations live in this process, which is only correct for a single worker.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 5000))
+
+_responses = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_generations = {}
+_generations_lock = threading.Lock()
+_UNCACHED_HEADERS = ("content-length", "content-type")
+
+def owner_scope(owner_id: int):
+    return f"owner:{owner_id}"
+
+def project_scope(project_id: int):
+    return f"project:{project_id}"
+
+async def get_generations(scopes):
+    client = get_async_redis()
+    if client is None:
+        with _generations_lock:
+            return [_generations.get(scope, 0) for scope in scopes]
+    try:
+        values = await client.mget([f"gen:{scope}" for scope in scopes])
+    except redis.RedisError:
+        # Cannot tell whether another worker has invalidated: skip the cache.
+        return None
+    return [int(value or 0) for value in values]
+
+async def bump_generations(*scopes):
+    with _generations_lock:
+        for scope in scopes:
+            _generations[scope] = _generations.get(scope, 0) + 1
+    client = get_async_redis()
+    if client is None or not scopes:
+        return
+    try:
+        async with client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                pipe.incr(f"gen:{scope}")
+            await pipe.execute()
+    except redis.RedisError:
+        pass
+
+def make_etag(body: bytes):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def version_etag(version: int):
+    return f'"v{version}"'
+
+# Versions named by an If-Match header: None when it is absent or "*", otherwise
+# a list (empty if no tag is a strong version ETag, which then never matches).
+def if_match_versions(if_match: str):
+    if not if_match:
+        return None
+    tags = [tag.strip() for tag in if_match.split(",")]
+    if "*" in tags:
+        return None
+    return [int(m.group(1)) for m in (re.fullmatch(r'"v(\d+)"', tag) for tag in tags) if m]
+
+def _cache_key(request: Request, owner_id: int, generations, vary: str = None):
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    key = f"resp:{owner_id}:{'.'.join(map(str, generations))}:{request.url.path}?{query}"
+    return key if vary is None else f"{key}#{vary}"
+
+async def _lookup(key: str):
+    entry = _responses.get(key)
+    if entry is not None:
+        return entry
+    raw = await redis_get(key)
+    if raw is None:
+        return None
+    data = json.loads(raw)
+    entry = (data["etag"], data["body"].encode(), data["headers"])
+    _responses.set(key, entry)
+    return entry
+
+def _entry(response: Response):
+    headers = {k: v for k, v in response.headers.items() if k not in _UNCACHED_HEADERS}
+    return headers.pop("etag", None) or make_etag(response.body), response.body, headers
+
+async def _store(key: str, response: Response):
+    entry = _entry(response)
+    etag, body, headers = entry
+    _responses.set(key, entry)
+    await redis_set(key, json.dumps({"etag": etag, "body": body.decode(), "headers": headers}), RESPONSE_CACHE_TTL)
+    return entry
+
+# Serves a JSON GET through the cache; load() builds the response and is only awaited on a miss.
+# vary names any other input of load(), such as the date an overdue count was taken on.
+async def cached_response(request: Request, owner_id: int, load, project_id: int = None, vary: str = None):
+    scopes = [owner_scope(owner_id)] + ([project_scope(project_id)] if project_id is not None else [])
+    generations = await get_generations(scopes) if RESPONSE_CACHE_ENABLED else None
+    if generations is None:
+        etag, body, headers = _entry(await load())
+    else:
+        key = _cache_key(request, owner_id, generations, vary)
+        entry = await _lookup(key)
+        if entry is None:
+            entry = await _store(key, await load())
+        etag, body, headers = entry
+    headers = dict(headers, ETag=etag, Vary="Authorization")
+    headers.setdefault("Cache-Control", "private, no-cache")
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -1,36 +1,202 @@
 from celery import Celery
+from celery.schedules import crontab
 import os
 from dotenv import load_dotenv
 import datetime
+import time
+import uuid
+from itertools import groupby
 
 load_dotenv()
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_BACKEND_URL = os.getenv("CELERY_BACKEND_URL", "redis://redis:6379/0")
+OVERDUE_DIGEST_CHUNK_SIZE = int(os.getenv("OVERDUE_DIGEST_CHUNK_SIZE", 500))
+OVERDUE_DIGEST_YIELD_PER = int(os.getenv("OVERDUE_DIGEST_YIELD_PER", 1000))
+OVERDUE_DIGEST_MAX_TITLES = int(os.getenv("OVERDUE_DIGEST_MAX_TITLES", 200))
+# Hour of day (in the Celery timezone, UTC by default) the overdue digest goes out.
+OVERDUE_DIGEST_HOUR = int(os.getenv("OVERDUE_DIGEST_HOUR", 7))
+OUTBOX_DRAIN_INTERVAL = float(os.getenv("OUTBOX_DRAIN_INTERVAL", 10))
+PROJECT_PURGE_BATCH_SIZE = int(os.getenv("PROJECT_PURGE_BATCH_SIZE", 1000))
+# Optional pause between purge batches so other writers get the database (SQLite has a single writer).
+PROJECT_PURGE_BATCH_PAUSE = float(os.getenv("PROJECT_PURGE_BATCH_PAUSE", 0))
+PROJECT_PURGE_SWEEP_INTERVAL = float(os.getenv("PROJECT_PURGE_SWEEP_INTERVAL", 3600))
+# A purge that has not finished a batch for this long is presumed dead and may be taken over.
+PROJECT_PURGE_LEASE = float(os.getenv("PROJECT_PURGE_LEASE", 300))
 
 celery = Celery("worker", broker=CELERY_BROKER_URL, backend=CELERY_BACKEND_URL)
+celery.conf.beat_schedule = {
+    "drain-notification-outbox": {
+        "task": "app.celery_worker.drain_notification_outbox",
+        "schedule": OUTBOX_DRAIN_INTERVAL,
+    },
+    "purge-deleted-projects": {
+        "task": "app.celery_worker.purge_deleted_projects",
+        "schedule": PROJECT_PURGE_SWEEP_INTERVAL,
+    },
+    "send-daily-overdue-summary": {
+        "task": "app.celery_worker.send_daily_overdue_summary",
+        "schedule": crontab(hour=OVERDUE_DIGEST_HOUR, minute=0),
+    },
+}
 
+# Kept for one release so messages queued under this name by the previous version
+# still run; notifications are now written to the outbox. Remove after that deploy.
 @celery.task
 def send_email_async(to_email: str, subject: str, body: str):
-    from app.email_utils import send_email_smtp
-    send_email_smtp(to_email, subject, body)
+    from app.email_utils import send_email_batch
+    send_email_batch([(to_email, subject, body)])
+
+def iter_overdue_digests(db, today: datetime.date):
+    from sqlalchemy import select
+    from app import models
+    # Projects come off ix_projects_owner_id_id and each one's overdue tasks off the
+    # open-tasks partial index, already in the requested order, so nothing is sorted.
+    # yield_per streams the rows, so only the current owner's titles are held in memory.
+    stmt = select(models.Project.owner_id, models.User.email, models.Task.title).select_from(models.Task).join(
+        models.Project, models.Task.project_id == models.Project.id
+    ).join(
+        models.User, models.Project.owner_id == models.User.id
+    ).where(
+        models.Project.deleted_at.is_(None),
+        models.Task.due_date < today,
+        models.Task.status != "done"
+    ).order_by(models.Project.owner_id, models.Project.id, models.Task.due_date, models.Task.id).execution_options(yield_per=OVERDUE_DIGEST_YIELD_PER)
+    for (_, email), rows in groupby(db.execute(stmt), key=lambda row: (row.owner_id, row.email)):
+        titles, extra = [], 0
+        for row in rows:
+            if len(titles) < OVERDUE_DIGEST_MAX_TITLES:
+                titles.append(row.title)
+            else:
+                extra += 1
+        if extra:
+            titles.append(f"... and {extra} more")
+        yield email, titles
+
+@celery.task
+def send_overdue_digest_chunk(digests: list):
+    from app.email_utils import send_email_batch
+    failed = send_email_batch(
+        (email, "Daily Overdue Tasks Summary", "Your overdue tasks:\n" + "\n".join(titles)) for email, titles in digests
+    )
+    return len(digests) - len(failed)
 
 @celery.task
 def send_daily_overdue_summary():
     from app.database import SessionLocal
-    from app import crud, models
     db = SessionLocal()
+    chunks = 0
     try:
-        users = db.query(models.User).all()
-        today = datetime.date.today()
-        for user in users:
-            overdue_tasks = db.query(models.Task).join(models.Project).filter(
-                models.Project.owner_id == user.id,
-                models.Task.due_date < today,
-                models.Task.status != "done"
-            ).all()
-            if overdue_tasks:
-                body = "Your overdue tasks:\n" + "\n".join([t.title for t in overdue_tasks])
-                send_email_smtp(user.email, "Daily Overdue Tasks Summary", body)
+        chunk = []
+        for digest in iter_overdue_digests(db, datetime.date.today()):
+            chunk.append(digest)
+            if len(chunk) >= OVERDUE_DIGEST_CHUNK_SIZE:
+                send_overdue_digest_chunk.delay(chunk)
+                chunks += 1
+                chunk = []
+        if chunk:
+            send_overdue_digest_chunk.delay(chunk)
+            chunks += 1
     finally:
         db.close()
+    return chunks
+
+@celery.task
+def reconcile_project_stats(project_id: int = None):
+    from app.database import SessionLocal
+    from app import stats
+    with SessionLocal() as db:
+        return stats.reconcile(db, project_id)
+
+@celery.task
+def drain_notification_outbox():
+    from app.database import SessionLocal
+    from app import outbox
+    sent = 0
+    with SessionLocal() as db:
+        while True:
+            drained = outbox.drain(db)
+            sent += drained
+            if drained < outbox.OUTBOX_BATCH_SIZE:
+                return sent
+
+def _purge_claimable(now: datetime.datetime):
+    from sqlalchemy import or_
+    from app import models
+    p = models.Project
+    return or_(p.purge_claimed_at.is_(None), p.purge_claimed_at < now - datetime.timedelta(seconds=PROJECT_PURGE_LEASE))
+
+def claim_project_purge(db, project_id: int):
+    # Returns a claim token, or None if the project is not deleted or another purge
+    # holds a live lease on it. The condition is checked in the UPDATE itself, so
+    # of two jobs racing for a project only one gets it.
+    from sqlalchemy import update
+    from app import models
+    p, now, token = models.Project, models._utcnow(), uuid.uuid4().hex
+    claimed = db.execute(update(p).where(p.id == project_id, p.deleted_at.is_not(None), _purge_claimable(now)).values(
+        purge_claimed_at=now, purge_claim_token=token
+    ).returning(p.id)).first()
+    db.commit()
+    return token if claimed else None
+
+def iter_project_purge(db, project_id: int, token: str):
+    from sqlalchemy import delete, select, update
+    from app import models
+    # Deletes the project's tasks in short transactions. Each batch is a range scan
+    # of ix_tasks_project_id_id after the last deleted id, so no lock is held for
+    # long and memory stays at one batch of ids. Every batch renews the lease and
+    # stops if another job has taken it over. Yields the running total.
+    p = models.Project
+    holds_lease = (p.id == project_id, p.purge_claim_token == token)
+    last_id, deleted = 0, 0
+    while True:
+        if not db.execute(update(p).where(*holds_lease).values(purge_claimed_at=models._utcnow())).rowcount:
+            db.rollback()
+            return
+        ids = db.scalars(select(models.Task.id).where(
+            models.Task.project_id == project_id, models.Task.id > last_id
+        ).order_by(models.Task.id).limit(PROJECT_PURGE_BATCH_SIZE)).all()
+        if not ids:
+            break
+        db.execute(delete(models.Task).where(models.Task.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        last_id = ids[-1]
+        yield deleted
+        if PROJECT_PURGE_BATCH_PAUSE:
+            time.sleep(PROJECT_PURGE_BATCH_PAUSE)
+    db.execute(delete(models.ProjectTaskCounter).where(models.ProjectTaskCounter.project_id == project_id))
+    db.execute(delete(p).where(*holds_lease, p.deleted_at.is_not(None)))
+    db.commit()
+
+@celery.task(bind=True)
+def purge_project(self, project_id: int):
+    from sqlalchemy import func, select
+    from app.database import SessionLocal
+    from app import models
+    with SessionLocal() as db:
+        token = claim_project_purge(db, project_id)
+        if token is None:
+            return 0
+        total = db.scalar(select(func.count()).select_from(models.Task).where(models.Task.project_id == project_id))
+        deleted = 0
+        for deleted in iter_project_purge(db, project_id, token):
+            if self.request.id:
+                self.update_state(state="PROGRESS", meta={"project_id": project_id, "deleted": deleted, "total": total})
+    return deleted
+
+@celery.task
+def purge_deleted_projects():
+    # Safety net for purges that were never enqueued or died midway.
+    from sqlalchemy import select
+    from app.database import SessionLocal
+    from app import models
+    # Projects whose purge is still renewing its lease are skipped; purge_project
+    # re-checks the lease, so a job queued twice still runs only once.
+    now = models._utcnow()
+    cutoff = now - datetime.timedelta(seconds=PROJECT_PURGE_SWEEP_INTERVAL)
+    with SessionLocal() as db:
+        project_ids = db.scalars(select(models.Project.id).where(models.Project.deleted_at < cutoff, _purge_claimable(now))).all()
+    for project_id in project_ids:
+        purge_project.delay(project_id)
+    return len(project_ids)
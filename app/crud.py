@@ -1,56 +1,95 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.hash import bcrypt
+from sqlalchemy import and_, or_, bindparam, column, func, select, insert, update, delete, tuple_, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from . import models, schemas, pagination, hashing, search, stats, outbox
 
 # ---------- USERS ----------
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed = bcrypt.hash(user.password)
+# Callers that change a user's email or delete a user must await
+# auth.invalidate_principal(user_id) after the commit.
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed = await hashing.hash_password(user.password)
     db_user = models.User(email=user.email, hashed_password=hashed)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email).limit(1))
 
-def get_user_by_id(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    return await db.scalar(select(models.User).where(models.User.id == user_id).limit(1))
 
 # ---------- PROJECTS ----------
-def create_project(db: Session, project: schemas.ProjectCreate, owner_id: int):
+# Soft-deleted projects (and their tasks) are invisible to every read and write.
+LIVE_PROJECT = models.Project.deleted_at.is_(None)
+
+async def create_project(db: AsyncSession, project: schemas.ProjectCreate, owner_id: int):
     db_project = models.Project(name=project.name, description=project.description, owner_id=owner_id)
     db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
+    await db.commit()
+    await db.refresh(db_project)
     return db_project
 
-def get_user_projects(db: Session, owner_id: int):
-    return db.query(models.Project).filter(models.Project.owner_id == owner_id).all()
+async def _all(db: AsyncSession, q, columns):
+    # ORM instances for a single entity, plain Core rows for a column list.
+    result = await db.execute(q)
+    return result.scalars().all() if len(columns) == 1 else result.all()
+
+async def get_user_projects(db: AsyncSession, owner_id: int, columns=(models.Project,)):
+    return await _all(db, select(*columns).where(models.Project.owner_id == owner_id, LIVE_PROJECT).order_by(models.Project.id), columns)
+
+async def get_project(db: AsyncSession, project_id: int, owner_id: int):
+    return await db.scalar(select(models.Project).where(models.Project.id == project_id, models.Project.owner_id == owner_id, LIVE_PROJECT).limit(1))
+
+async def update_project(db: AsyncSession, project_id: int, owner_id: int, project_update: schemas.ProjectCreate, versions=None):
+    # One UPDATE ... RETURNING; versions (from If-Match) guards against lost updates.
+    p = models.Project
+    stmt = update(p).where(p.id == project_id, p.owner_id == owner_id, LIVE_PROJECT)
+    if versions is not None:
+        stmt = stmt.where(p.version.in_(versions))
+    row = (await db.execute(stmt.values(
+        name=project_update.name, description=project_update.description, version=p.version + 1
+    ).returning(p.name, p.description, p.id, p.owner_id, p.version))).first()
+    if row is None:
+        raise await _project_write_failure(db, project_id, owner_id)
+    await db.commit()
+    return row
 
-def get_project(db: Session, project_id: int, owner_id: int):
-    return db.query(models.Project).filter(models.Project.id == project_id, models.Project.owner_id == owner_id).first()
+async def delete_project(db: AsyncSession, project_id: int, owner_id: int, versions=None):
+    # Soft delete only; celery_worker.purge_project removes the tasks in batches.
+    p = models.Project
+    stmt = update(p).where(p.id == project_id, p.owner_id == owner_id, LIVE_PROJECT)
+    if versions is not None:
+        stmt = stmt.where(p.version.in_(versions))
+    row = (await db.execute(stmt.values(deleted_at=models._utcnow(), version=p.version + 1).returning(p.id, p.deleted_at))).first()
+    if row is None:
+        raise await _project_write_failure(db, project_id, owner_id)
+    await db.commit()
+    return row
 
-def update_project(db: Session, project_id: int, owner_id: int, project_update: schemas.ProjectCreate):
-    project = get_project(db, project_id, owner_id)
-    if not project:
+async def get_project_deletion(db: AsyncSession, project_id: int, owner_id: int):
+    # A soft-deleted project that is still being purged, with its remaining task count.
+    p = models.Project
+    deleted_at = await db.scalar(select(p.deleted_at).where(p.id == project_id, p.owner_id == owner_id, p.deleted_at.is_not(None)))
+    if deleted_at is None:
         return None
-    project.name = project_update.name
-    project.description = project_update.description
-    db.commit()
-    db.refresh(project)
-    return project
-
-def delete_project(db: Session, project_id: int, owner_id: int):
-    project = get_project(db, project_id, owner_id)
-    if not project:
-        return False
-    db.delete(project)
-    db.commit()
-    return True
+    remaining = await db.scalar(select(func.count()).select_from(models.Task).where(models.Task.project_id == project_id))
+    return {"project_id": project_id, "deleted_at": deleted_at, "remaining_tasks": remaining}
+
+# ---------- PROJECT STATS ----------
+async def apply_task_counters(db: AsyncSession, deltas):
+    # Call before commit so the counters change in the same transaction as the tasks.
+    stmt = stats.upsert_counters(db.bind.dialect.name, deltas)
+    if stmt is not None:
+        await db.execute(stmt)
+
+async def get_project_stats(db: AsyncSession, owner_id: int, today, project_id: int = None):
+    rows = await db.execute(stats.stats_query(owner_id, today, project_id=project_id))
+    return stats.build_stats(rows)
 
 # ---------- TASKS ----------
-def create_task(db: Session, task: schemas.TaskCreate):
+async def create_task(db: AsyncSession, task: schemas.TaskCreate):
     db_task = models.Task(
         title=task.title,
         description=task.description,
@@ -61,50 +100,293 @@ def create_task(db: Session, task: schemas.TaskCreate):
         assigned_user_id=task.assigned_user_id
     )
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+    await db.flush()
+    await apply_task_counters(db, stats.counter_deltas(new=db_task))
+    await outbox.enqueue(db, outbox.task_events(db_task))
+    await db.commit()
+    await db.refresh(db_task)
     return db_task
 
-def get_tasks_filtered(db: Session, owner_id: int, skip: int = 0, limit: int = 10, status=None, priority=None, project_id=None, due_date=None):
-    q = db.query(models.Task).join(models.Project).filter(models.Project.owner_id == owner_id)
+def _filtered_tasks_query(owner_id: int, status=None, priority=None, project_id=None, due_date=None, columns=(models.Task,)):
+    q = select(*columns).select_from(models.Task).join(models.Project).where(models.Project.owner_id == owner_id, LIVE_PROJECT)
     if status:
-        q = q.filter(models.Task.status == status)
+        q = q.where(models.Task.status == status)
     if priority is not None:
-        q = q.filter(models.Task.priority == priority)
+        q = q.where(models.Task.priority == priority)
     if project_id:
-        q = q.filter(models.Task.project_id == project_id)
+        q = q.where(models.Task.project_id == project_id)
     if due_date:
-        q = q.filter(models.Task.due_date == due_date)
-    return q.offset(skip).limit(limit).all()
+        q = q.where(models.Task.due_date == due_date)
+    return q
+
+async def get_tasks_filtered(db: AsyncSession, owner_id: int, skip: int = 0, limit: int = 10, status=None, priority=None, project_id=None, due_date=None,
+                             columns=(models.Task,)):
+    q = _filtered_tasks_query(owner_id, status=status, priority=priority, project_id=project_id, due_date=due_date, columns=columns)
+    return await _all(db, q.order_by(models.Task.id).offset(skip).limit(limit), columns)
+
+def _task_sort_key(task: models.Task, sort: str):
+    return task.id if sort == "id" else getattr(task, sort)
 
-def get_task(db: Session, task_id: int):
-    return db.query(models.Task).filter(models.Task.id == task_id).first()
+async def get_tasks_page(db: AsyncSession, owner_id: int, limit: int = 10, cursor: str = None, sort: str = "id", status=None, priority=None, project_id=None, due_date=None,
+                         columns=(models.Task,)):
+    if sort not in pagination.TASK_SORT_KEYS:
+        raise pagination.InvalidCursor(f"sort must be one of: {', '.join(pagination.TASK_SORT_KEYS)}")
+    q = _filtered_tasks_query(owner_id, status=status, priority=priority, project_id=project_id, due_date=due_date, columns=columns)
+    # One extra row tells whether another page exists, so the last page has no cursor.
+    if sort == "id":
+        q = q.order_by(models.Task.id)
+        if cursor:
+            _, last_id = pagination.decode_cursor(cursor, sort)
+            q = q.where(models.Task.id > last_id)
+        tasks = await _all(db, q.limit(limit + 1), columns)
+    else:
+        # NULL keys sort last. The non-NULL head and the NULL tail are read as two
+        # queries, each a single range seek on a (..., key, id) index: the head
+        # with a row-value comparison, the tail by id alone.
+        col = getattr(models.Task, sort)
+        key, last_id = pagination.decode_cursor(cursor, sort) if cursor else (None, None)
+        tasks = []
+        if not cursor or key is not None:
+            head = q.where(col.is_not(None)).order_by(col, models.Task.id)
+            if cursor:
+                head = head.where(tuple_(col, models.Task.id) > tuple_(key, last_id))
+            tasks = list(await _all(db, head.limit(limit + 1), columns))
+        if len(tasks) <= limit:
+            tail = q.where(col.is_(None)).order_by(models.Task.id)
+            if cursor and key is None:
+                tail = tail.where(models.Task.id > last_id)
+            tasks += await _all(db, tail.limit(limit + 1 - len(tasks)), columns)
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        last = tasks[-1]
+        next_cursor = pagination.encode_cursor(sort, _task_sort_key(last, sort), last.id)
+    return tasks, next_cursor
 
-def get_task_with_owner(db: Session, task_id: int, owner_id: int):
-    return db.query(models.Task).join(models.Project).filter(
+async def stream_task_rows(db: AsyncSession, owner_id: int, fields, yield_per: int = 1000, status=None, priority=None, project_id=None, due_date=None):
+    # Plain row tuples from a server-side cursor, yielded one fetch partition at a time.
+    q = _filtered_tasks_query(owner_id, status=status, priority=priority, project_id=project_id, due_date=due_date,
+                              columns=[getattr(models.Task, field) for field in fields])
+    result = await db.stream(q.order_by(models.Task.id).execution_options(yield_per=yield_per))
+    async for rows in result.partitions():
+        yield rows
+
+async def search_tasks(db: AsyncSession, owner_id: int, q: str, limit: int = 10, cursor: str = None):
+    stmt, rank = search.search_query(db.bind.dialect.name, q)
+    stmt = stmt.add_columns(rank.label("rank")).join(
+        models.Project, models.Task.project_id == models.Project.id
+    ).where(models.Project.owner_id == owner_id, LIVE_PROJECT)
+    if cursor:
+        last_rank, last_id = pagination.decode_cursor(cursor, "rank")
+        stmt = stmt.where(or_(rank > last_rank, and_(rank == last_rank, models.Task.id > last_id)))
+    rows = (await db.execute(stmt.order_by(rank, models.Task.id).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor("rank", rows[-1].rank, rows[-1].Task.id)
+    return [row.Task for row in rows], next_cursor
+
+async def get_task(db: AsyncSession, task_id: int):
+    return await db.scalar(select(models.Task).where(models.Task.id == task_id).limit(1))
+
+async def get_task_with_owner(db: AsyncSession, task_id: int, owner_id: int):
+    return await db.scalar(select(models.Task).join(models.Project).where(
         models.Task.id == task_id,
-        models.Project.owner_id == owner_id
-    ).first()
+        models.Project.owner_id == owner_id,
+        LIVE_PROJECT
+    ).limit(1))
+
+# ---------- CONDITIONAL WRITES ----------
+class NotFound(Exception):
+    pass
+
+class NotOwned(Exception):
+    pass
+
+class VersionConflict(Exception):
+    pass
+
+TASK_UPDATE_FIELDS = ("title", "description", "status", "priority", "due_date", "assigned_user_id")
+# Pre-update state needed for the stats counters and the notification outbox.
+TASK_STATE_FIELDS = ("project_id", "status", "priority", "due_date", "assigned_user_id", "version")
+TASK_UPDATE_RETRIES = 5
 
-def update_task(db: Session, task_id: int, task_update: schemas.TaskCreate):
-    task = get_task(db, task_id)
-    if not task:
+async def _project_write_failure(db: AsyncSession, project_id: int, owner_id: int):
+    # Only runs once a conditional write matched nothing, to tell the caller why.
+    exists = await db.scalar(select(models.Project.id).where(models.Project.id == project_id, models.Project.owner_id == owner_id, LIVE_PROJECT))
+    return VersionConflict() if exists else NotFound()
+
+async def _task_write_failure(db: AsyncSession, task_id: int, owner_id: int):
+    row = (await db.execute(select(models.Project.owner_id, models.Project.deleted_at).select_from(models.Task).outerjoin(
+        models.Project, models.Task.project_id == models.Project.id
+    ).where(models.Task.id == task_id))).first()
+    if row is None or row.deleted_at is not None:
+        return NotFound()
+    return VersionConflict() if row.owner_id == owner_id else NotOwned()
+
+def _task_returning(t):
+    return [getattr(t, field) for field in ("id",) + TASK_FIELDS + ("version",)]
+
+async def _update_task_once(db: AsyncSession, task_id: int, owner_id: int, values, versions):
+    t, p = models.Task, models.Project
+    stmt = update(t).where(t.id == task_id, t.project_id == p.id, p.owner_id == owner_id, LIVE_PROJECT)
+    if versions is not None:
+        stmt = stmt.where(t.version.in_(versions))
+    values = dict(values, version=t.version + 1)
+    if db.bind.dialect.name == "postgresql":
+        # A single UPDATE ... FROM projects, tasks AS old: the self-joined row is the
+        # pre-update snapshot, and a concurrent writer bumping version makes the
+        # re-checked WHERE fail instead of returning stale old values.
+        old = aliased(models.Task, name="old")
+        stmt = stmt.where(old.id == t.id, t.version == old.version).values(**values).returning(
+            *_task_returning(t), *[getattr(old, f).label(f"old_{f}") for f in TASK_STATE_FIELDS]
+        )
+        row = (await db.execute(stmt)).first()
+        if row is None:
+            return None
+        return dict(row._mapping), {f: row._mapping[f"old_{f}"] for f in TASK_STATE_FIELDS}
+    # SQLite cannot return columns of other FROM tables, so the old state is read
+    # first in the same transaction and pinned by its version.
+    old = (await db.execute(select(*[getattr(t, f) for f in TASK_STATE_FIELDS]).where(t.id == task_id))).first()
+    if old is None:
         return None
-    task.title = task_update.title
-    task.description = task_update.description
-    task.status = task_update.status
-    task.priority = task_update.priority
-    task.due_date = task_update.due_date
-    task.project_id = task_update.project_id
-    task.assigned_user_id = task_update.assigned_user_id
-    db.commit()
-    db.refresh(task)
-    return task
-
-def delete_task(db: Session, task_id: int):
-    task = get_task(db, task_id)
-    if not task:
-        return False
-    db.delete(task)
-    db.commit()
-    return True
+    row = (await db.execute(stmt.where(t.version == old.version).values(**values).returning(*_task_returning(t)))).first()
+    return (dict(row._mapping), dict(old._mapping)) if row is not None else None
+
+async def update_task(db: AsyncSession, task_id: int, owner_id: int, task_update: schemas.TaskCreate, versions=None):
+    # Never moves a task to another project. Returns the updated row as a dict.
+    values = {field: getattr(task_update, field) for field in TASK_UPDATE_FIELDS}
+    for _ in range(TASK_UPDATE_RETRIES):
+        result = await _update_task_once(db, task_id, owner_id, values, versions)
+        if result is not None:
+            break
+        failure = await _task_write_failure(db, task_id, owner_id)
+        # Without If-Match a lost race against another writer is simply retried.
+        if not isinstance(failure, VersionConflict) or versions is not None:
+            raise failure
+    else:
+        raise VersionConflict()
+    new, old = result
+    await apply_task_counters(db, stats.counter_deltas(old=old, new=new))
+    await outbox.enqueue(db, outbox.task_events(new, old))
+    await db.commit()
+    return new
+
+async def delete_task(db: AsyncSession, task_id: int, owner_id: int, versions=None):
+    t, p = models.Task, models.Project
+    stmt = delete(t).where(t.id == task_id, t.project_id.in_(select(p.id).where(p.owner_id == owner_id, LIVE_PROJECT)))
+    if versions is not None:
+        stmt = stmt.where(t.version.in_(versions))
+    old = (await db.execute(stmt.returning(t.id, t.project_id, t.status, t.priority, t.due_date))).first()
+    if old is None:
+        raise await _task_write_failure(db, task_id, owner_id)
+    await apply_task_counters(db, stats.counter_deltas(old=old))
+    await db.commit()
+    return old
+
+# ---------- BULK TASKS ----------
+TASK_FIELDS = ("title", "description", "status", "priority", "due_date", "project_id", "assigned_user_id")
+
+async def get_owned_project_ids(db: AsyncSession, owner_id: int, project_ids):
+    if not project_ids:
+        return set()
+    rows = await db.scalars(select(models.Project.id).where(models.Project.owner_id == owner_id, LIVE_PROJECT, models.Project.id.in_(project_ids)))
+    return set(rows)
+
+async def get_owned_tasks(db: AsyncSession, owner_id: int, task_ids):
+    if not task_ids:
+        return {}
+    rows = await db.execute(select(
+        models.Task.id, models.Task.project_id, models.Task.status, models.Task.priority, models.Task.due_date, models.Task.assigned_user_id,
+        models.Task.version
+    ).join(models.Project).where(
+        models.Project.owner_id == owner_id,
+        LIVE_PROJECT,
+        models.Task.id.in_(task_ids)
+    ))
+    return {row.id: row for row in rows}
+
+# Rows per multi-row INSERT or UPDATE ... FROM (VALUES ...), which keeps the bind
+# parameters under SQLite's and asyncpg's limits.
+TASK_BULK_CHUNK = 500
+
+def _with_defaults(row):
+    # Like an ORM insert, an explicit None falls back to the column default.
+    columns = models.Task.__table__.c
+    return {field: columns[field].default.arg if value is None and columns[field].default is not None else value
+            for field, value in row.items()}
+
+async def bulk_create_tasks(db: AsyncSession, tasks):
+    # One multi-row INSERT per chunk. Results, counters and notifications come from
+    # what RETURNING reports was stored. Ids are assigned in VALUES order, so
+    # sorting the returned rows by id restores the order of tasks.
+    t = models.Task
+    rows = [_with_defaults({field: getattr(task, field) for field in TASK_FIELDS}) for task in tasks]
+    created = []
+    for start in range(0, len(rows), TASK_BULK_CHUNK):
+        stmt = insert(t).values(rows[start:start + TASK_BULK_CHUNK]).returning(t.id, *(t.__table__.c[field] for field in TASK_FIELDS))
+        created += sorted((dict(row._mapping) for row in await db.execute(stmt)), key=lambda row: row["id"])
+    if not created:
+        return []
+    deltas = None
+    for row in created:
+        deltas = stats.counter_deltas(new=row, deltas=deltas)
+    await apply_task_counters(db, deltas)
+    await outbox.enqueue(db, [event for row in created for event in outbox.task_events(row)])
+    await db.commit()
+    return created
+
+def _task_values(rows, fields):
+    # Typed binds rather than plain values: a None would render as a bare NULL,
+    # which Postgres types as text when a whole column is NULL.
+    types = [models.Task.__table__.c[field].type for field in fields]
+    return values(*(column(field, type_) for field, type_ in zip(fields, types)), name="v").data([
+        tuple(bindparam(None, row[field], type_=type_) for field, type_ in zip(fields, types)) for row in rows
+    ]).cte("v")
+
+def bulk_update_statement(owner_id: int, chunk):
+    t, p = models.Task, models.Project
+    v = _task_values(chunk, ("id", "version") + TASK_UPDATE_FIELDS)
+    return update(t).where(
+        t.id == v.c.id, t.version == v.c.version,
+        t.project_id.in_(select(p.id).where(p.owner_id == owner_id, LIVE_PROJECT))
+    ).values(**{field: v.c[field] for field in TASK_UPDATE_FIELDS}, version=t.version + 1).returning(t.id)
+
+async def bulk_update_tasks(db: AsyncSession, owner_id: int, rows, previous):
+    # A row only applies while its task still has the version read into previous,
+    # so a concurrent write is never overwritten. Returns the rows that applied,
+    # with their new version; the caller reports the rest as conflicts.
+    applied = set()
+    for start in range(0, len(rows), TASK_BULK_CHUNK):
+        chunk = [dict(row, version=previous[row["id"]].version) for row in rows[start:start + TASK_BULK_CHUNK]]
+        stmt = bulk_update_statement(owner_id, chunk)
+        applied.update((await db.execute(stmt.execution_options(synchronize_session=False))).scalars())
+    updated = [dict(row, version=previous[row["id"]].version + 1) for row in rows if row["id"] in applied]
+    if updated:
+        deltas = None
+        for row in updated:
+            deltas = stats.counter_deltas(old=previous[row["id"]], new=row, deltas=deltas)
+        await apply_task_counters(db, deltas)
+        await outbox.enqueue(db, [event for row in updated for event in outbox.task_events(row, previous[row["id"]])])
+    await db.commit()
+    return updated
+
+async def bulk_delete_tasks(db: AsyncSession, owner_id: int, task_ids):
+    # Ownership check and delete are one statement per chunk; counters are adjusted
+    # from the rows it actually removed, never from an earlier read.
+    t, p = models.Task, models.Project
+    task_ids = list(task_ids)
+    deleted = []
+    for start in range(0, len(task_ids), TASK_BULK_CHUNK):
+        stmt = delete(t).where(
+            t.id.in_(task_ids[start:start + TASK_BULK_CHUNK]),
+            t.project_id.in_(select(p.id).where(p.owner_id == owner_id, LIVE_PROJECT))
+        ).returning(t.id, t.project_id, t.status, t.priority, t.due_date)
+        deleted += (await db.execute(stmt.execution_options(synchronize_session=False))).all()
+    if deleted:
+        deltas = None
+        for task in deleted:
+            deltas = stats.counter_deltas(old=task, deltas=deltas)
+        await apply_task_counters(db, deltas)
+        await db.commit()
+    return deleted
@@ -0,0 +1,5 @@
+from . import database
+
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
@@ -1,24 +1,166 @@
+import logging
+import os
+import queue
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
-from fastapi import BackgroundTasks
-import os
+
+logger = logging.getLogger(__name__)
 
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 4))
+# Idle connections older than this are probed with NOOP before reuse.
+SMTP_NOOP_INTERVAL = float(os.getenv("SMTP_NOOP_INTERVAL", 30))
+SMTP_MAX_IDLE = float(os.getenv("SMTP_MAX_IDLE", 300))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+SMTP_MESSAGE_ID_DOMAIN = os.getenv("SMTP_MESSAGE_ID_DOMAIN", (SMTP_USER or "").rpartition("@")[2] or "localhost")
 
-def send_email_smtp(to_email: str, subject: str, body: str):
+# Errors after which the connection can no longer be trusted.
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+# Per-message rejections; the session stays usable for the rest of the batch.
+_REFUSALS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+def build_message(to_email: str, subject: str, body: str, idempotency_key: str = None):
     msg = EmailMessage()
     msg["From"] = SMTP_USER
     msg["To"] = to_email
     msg["Subject"] = subject
+    if idempotency_key:
+        # A stable Message-ID lets receivers drop duplicates of a retried delivery.
+        msg["Message-ID"] = f"<{idempotency_key}@{SMTP_MESSAGE_ID_DOMAIN}>"
+        msg["X-Idempotency-Key"] = idempotency_key
     msg.set_content(body)
+    return msg
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+class SMTPConnectionPool:
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD)
+        except Exception:
+            smtp.close()
+            raise
+        return _PooledConnection(smtp)
+
+    def _is_usable(self, conn: _PooledConnection):
+        idle = time.monotonic() - conn.last_used
+        if idle > SMTP_MAX_IDLE or conn.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            return False
+        if idle > SMTP_NOOP_INTERVAL:
+            try:
+                return conn.smtp.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        return True
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.login(SMTP_USER, SMTP_PASSWORD)
-        smtp.send_message(msg)
+    def _checkout(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_usable(conn):
+                    return conn
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn: _PooledConnection):
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn: _PooledConnection):
+        conn.close()
+        self._slots.release()
+
+    # Sends every message over one pooled session; returns (message, error) pairs
+    # for those the server refused.
+    def send_messages(self, messages):
+        refused = []
+        conn = self._checkout()
+        try:
+            for msg in messages:
+                if conn.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                    conn.close()
+                    conn = self._connect()
+                try:
+                    try:
+                        conn.smtp.send_message(msg)
+                    except _CONNECTION_ERRORS:
+                        # Reconnect once and retry; a second failure aborts the batch.
+                        conn.close()
+                        conn = self._connect()
+                        conn.smtp.send_message(msg)
+                except _REFUSALS as e:
+                    logger.warning("SMTP server refused message to %s: %s", msg["To"], e)
+                    refused.append((msg, e))
+                conn.sent += 1
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+        return refused
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_smtp_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPConnectionPool()
+        return _pool
+
+def _reset_pool_after_fork():
+    # Sockets must not be shared with a forked child (e.g. prefork Celery workers).
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def send_email_smtp(to_email: str, subject: str, body: str):
+    # Raises the server's refusal, as smtplib does.
+    for _, error in get_smtp_pool().send_messages([build_message(to_email, subject, body)]):
+        raise error
 
-def send_email_background(background_tasks: BackgroundTasks, to_email: str, subject: str, body: str):
-    background_tasks.add_task(send_email_smtp, to_email, subject, body)
+def send_email_batch(messages):
+    # messages are (to_email, subject, body) or (to_email, subject, body, idempotency_key)
+    # tuples. Returns (message, error) pairs for the refused ones.
+    return get_smtp_pool().send_messages(build_message(*message) for message in messages)
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque, namedtuple
+import orjson
+import redis
+import redis.asyncio as aioredis
+from . import cache, serialization
+
+logger = logging.getLogger(__name__)
+
+# Per-project task change feed behind GET /projects/{id}/events. With a Redis URL
+# every event is appended to a capped stream per project (the replay buffer for
+# Last-Event-ID) and a pub/sub message wakes the workers that have listeners for
+# that project. Without one, an in-process broker does the same for a single worker.
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", cache.CACHE_REDIS_URL)
+EVENTS_REPLAY_SIZE = int(os.getenv("EVENTS_REPLAY_SIZE", 1000))
+EVENTS_REPLAY_TTL = int(os.getenv("EVENTS_REPLAY_TTL", 86400))
+# Events a listener may fall behind by before it is disconnected to resume from the replay buffer.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 256))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", 15))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+
+CHANNEL_PREFIX = "events:project:"
+
+Event = namedtuple("Event", "id type data")
+
+def event_order(event_id: str):
+    # Redis stream ids are "<ms>-<seq>"; the in-process broker uses plain counters.
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+class Subscription:
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.lagged = False
+
+    def deliver(self, event: Event):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop the backlog and end the stream; the client reconnects with
+            # Last-Event-ID and catches up from the replay buffer.
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+class _Fanout:
+    def __init__(self):
+        self._subscriptions = {}
+
+    async def subscribe(self, project_id: int):
+        subscription = Subscription(project_id)
+        self._subscriptions.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.project_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self._subscriptions.pop(subscription.project_id, None)
+
+    def _dispatch(self, project_id: int, event: Event):
+        for subscription in list(self._subscriptions.get(project_id, ())):
+            subscription.deliver(event)
+
+class MemoryBroker(_Fanout):
+    def __init__(self):
+        super().__init__()
+        # project_id -> (last publish time, events), least recently published first.
+        # Like the Redis stream's EXPIRE, a buffer idle for EVENTS_REPLAY_TTL is
+        # dropped, but never while someone is listening to the project.
+        self._buffers = OrderedDict()
+        self._seq = 0
+
+    async def publish(self, events):
+        now = time.monotonic()
+        for project_id, type_, data in events:
+            self._seq += 1
+            event = Event(str(self._seq), type_, data)
+            _, buffer = self._buffers.pop(project_id, (None, None))
+            if buffer is None:
+                buffer = deque(maxlen=EVENTS_REPLAY_SIZE)
+            buffer.append(event)
+            self._buffers[project_id] = (now, buffer)
+            self._dispatch(project_id, event)
+        self._evict(now)
+
+    async def replay(self, project_id: int, from_id: str):
+        start = event_order(from_id)
+        _, buffer = self._buffers.get(project_id, (None, ()))
+        return [e for e in buffer if event_order(e.id) >= start]
+
+    def unsubscribe(self, subscription: Subscription):
+        super().unsubscribe(subscription)
+        project_id = subscription.project_id
+        published_at, _ = self._buffers.get(project_id, (None, None))
+        if project_id not in self._subscriptions and published_at is not None and time.monotonic() - published_at >= EVENTS_REPLAY_TTL:
+            del self._buffers[project_id]
+
+    def _evict(self, now: float):
+        for _ in range(len(self._buffers)):
+            project_id = next(iter(self._buffers))
+            published_at, _ = self._buffers[project_id]
+            if now - published_at < EVENTS_REPLAY_TTL:
+                return
+            if project_id in self._subscriptions:
+                self._buffers.move_to_end(project_id)
+            else:
+                del self._buffers[project_id]
+
+class RedisBroker(_Fanout):
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self._client = None
+        self._listener = None
+        # Last stream id handed to local listeners, per project with listeners.
+        self._cursors = {}
+
+    def _redis(self):
+        if self._client is None:
+            self._client = aioredis.Redis.from_url(self.url, socket_connect_timeout=1)
+        return self._client
+
+    async def publish(self, events):
+        async with self._redis().pipeline(transaction=False) as pipe:
+            for project_id, type_, data in events:
+                pipe.xadd(CHANNEL_PREFIX + str(project_id), {"type": type_, "data": data}, maxlen=EVENTS_REPLAY_SIZE, approximate=True)
+            for project_id in {project_id for project_id, _, _ in events}:
+                pipe.expire(CHANNEL_PREFIX + str(project_id), EVENTS_REPLAY_TTL)
+                pipe.publish(CHANNEL_PREFIX + str(project_id), b"")
+            await pipe.execute()
+
+    async def _range(self, project_id: int, start: str):
+        events = []
+        while True:
+            entries = await self._redis().xrange(CHANNEL_PREFIX + str(project_id), min=start, count=EVENTS_REPLAY_SIZE)
+            events += [Event(i.decode(), fields[b"type"].decode(), fields[b"data"]) for i, fields in entries]
+            if len(entries) < EVENTS_REPLAY_SIZE:
+                return events
+            start = "(" + events[-1].id
+
+    async def replay(self, project_id: int, from_id: str):
+        return await self._range(project_id, from_id)
+
+    async def subscribe(self, project_id: int):
+        if project_id not in self._cursors:
+            tail = await self._redis().xrevrange(CHANNEL_PREFIX + str(project_id), count=1)
+            self._cursors.setdefault(project_id, tail[0][0].decode() if tail else "0-0")
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return await super().subscribe(project_id)
+
+    def unsubscribe(self, subscription: Subscription):
+        super().unsubscribe(subscription)
+        if subscription.project_id not in self._subscriptions:
+            self._cursors.pop(subscription.project_id, None)
+
+    async def _deliver(self, project_id: int):
+        # Pub/sub only says "something changed"; the stream is read from this
+        # worker's cursor, so events arrive in order and none are lost while reconnecting.
+        cursor = self._cursors.get(project_id)
+        if cursor is None:
+            return
+        for event in await self._range(project_id, "(" + cursor):
+            if project_id not in self._cursors:
+                return
+            self._cursors[project_id] = event.id
+            self._dispatch(project_id, event)
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis().pubsub()
+            try:
+                await pubsub.psubscribe(CHANNEL_PREFIX + "*")
+                for project_id in list(self._cursors):
+                    await self._deliver(project_id)
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        await self._deliver(int(message["channel"][len(CHANNEL_PREFIX):]))
+            except redis.RedisError:
+                logger.warning("Event feed lost its Redis connection, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+broker = RedisBroker(EVENTS_REDIS_URL) if EVENTS_REDIS_URL else MemoryBroker()
+
+# ---------- PUBLISHING ----------
+def _get(obj, field):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+def task_events(type_: str, tasks):
+    # Creates and updates carry the task as GET /tasks serves it; deletes only the id.
+    if type_ == "task.deleted":
+        return [(_get(t, "project_id"), type_, {"id": _get(t, "id")}) for t in tasks]
+    return [(_get(t, "project_id"), type_, {field: _get(t, field) for field in serialization.TASK_OUT_FIELDS}) for t in tasks]
+
+# Call after commit. Best effort: a failed publish is logged, and clients that
+# missed it see the change on their next full fetch.
+async def publish(events):
+    if not events:
+        return
+    try:
+        await broker.publish([(project_id, type_, orjson.dumps(payload)) for project_id, type_, payload in events])
+    except redis.RedisError:
+        logger.warning("Dropped %d change feed events", len(events), exc_info=True)
+
+# ---------- SSE ----------
+def _format(event: Event):
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event.id.encode(), event.type.encode(), event.data)
+
+async def stream(project_id: int, last_event_id: str = None):
+    yield b"retry: %d\n\n" % EVENTS_RETRY_MS
+    try:
+        subscription = await broker.subscribe(project_id)
+    except redis.RedisError:
+        logger.warning("Could not subscribe to events of project %s", project_id, exc_info=True)
+        return
+    try:
+        last = None
+        if last_event_id is not None:
+            backlog = await broker.replay(project_id, last_event_id)
+            if backlog and event_order(backlog[0].id) == event_order(last_event_id):
+                for event in backlog[1:]:
+                    yield _format(event)
+                last = event_order(backlog[-1].id)
+            else:
+                # The events after last_event_id are no longer buffered: the client has to refetch.
+                reset_id = backlog[-1].id if backlog else ""
+                yield _format(Event(reset_id, "reset", b"{}"))
+                last = event_order(reset_id) if backlog else None
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            if last is not None and event_order(event.id) <= last:
+                continue
+            yield _format(event)
+            if event.type == "project.deleted":
+                return
+    except redis.RedisError:
+        logger.warning("Event feed of project %s failed", project_id, exc_info=True)
+    finally:
+        broker.unsubscribe(subscription)
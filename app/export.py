@@ -0,0 +1,34 @@
+import csv
+import io
+import json
+import os
+from datetime import date
+from . import crud, database
+
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 2000))
+# Same field order as schemas.TaskOut.
+EXPORT_FIELDS = ("title", "description", "status", "priority", "due_date", "project_id", "assigned_user_id", "id")
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=lambda v: v.isoformat() if isinstance(v, date) else str(v)).encode
+
+def ndjson_chunk(rows):
+    return "".join(_encode_json(dict(zip(EXPORT_FIELDS, row))) + "\n" for row in rows).encode()
+
+def csv_chunk(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode()
+
+async def stream_tasks(owner_id: int, fmt: str, **filters):
+    # Uses its own session: the body is still streaming after the request's
+    # dependencies have been torn down.
+    serialize = ndjson_chunk if fmt == "ndjson" else csv_chunk
+    if fmt == "csv":
+        yield csv_chunk([EXPORT_FIELDS])
+    async with database.AsyncSessionLocal() as db:
+        async for rows in crud.stream_task_rows(db, owner_id, EXPORT_FIELDS, yield_per=EXPORT_YIELD_PER, **filters):
+            yield serialize(rows)
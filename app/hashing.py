@@ -0,0 +1,66 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.hash import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Requests allowed to wait for a free worker before new ones are rejected.
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", PASSWORD_HASH_WORKERS * 4))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", 1))
+
+class HashingPoolSaturated(Exception):
+    pass
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+def _hash(password: str, rounds: int):
+    return bcrypt.using(rounds=rounds).hash(password)
+
+def _verify(password: str, hashed: str):
+    return bcrypt.verify(password, hashed)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the web process is multi-threaded by the time this runs.
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def _reset_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+async def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingPoolSaturated()
+    try:
+        executor = _get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            _reset_executor(executor)
+            return await asyncio.wrap_future(_get_executor().submit(fn, *args))
+    finally:
+        _slots.release()
+
+async def hash_password(password: str):
+    return await _run(_hash, password, BCRYPT_ROUNDS)
+
+async def verify_password(password: str, hashed: str):
+    return await _run(_verify, password, hashed)
+
+def needs_rehash(hashed: str):
+    try:
+        return bcrypt.from_string(hashed).rounds != BCRYPT_ROUNDS
+    except ValueError:
+        return False
@@ -1,19 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Path, status
-from sqlalchemy.orm import Session
+import logging
+import os
+from datetime import date
+from fastapi import FastAPI, Depends, Header, HTTPException, Path, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from . import models, schemas, crud, auth, database, email_utils
-from app.celery_worker import send_email_async
-
-models.Base.metadata.create_all(bind=database.engine)
+from . import models, schemas, crud, auth, pagination, hashing, cache, search, export, metrics, serialization, events
+from .deps import get_db
+from app.celery_worker import purge_project
 
 app = FastAPI(title="Task Manager API - MacV AI")
+logger = logging.getLogger(__name__)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_celery()
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics(request: Request, authorization: str = Header(None)):
+        if not metrics.scrape_allowed(request.client.host if request.client else None, authorization):
+            raise HTTPException(status_code=403, detail="Not allowed to read metrics")
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+TASKS_BULK_MAX_ITEMS = int(os.getenv("TASKS_BULK_MAX_ITEMS", 5000))
+TASKS_PAGE_MAX_LIMIT = int(os.getenv("TASKS_PAGE_MAX_LIMIT", 1000))
+VERSION_CONFLICT = "Task was modified by another request, fetch it and retry"
+
+@app.exception_handler(hashing.HashingPoolSaturated)
+def hashing_pool_saturated(request: Request, exc: hashing.HashingPoolSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many concurrent password checks, retry shortly"},
+        headers={"Retry-After": str(hashing.PASSWORD_HASH_RETRY_AFTER)},
+    )
+
+def _json_response(content, headers=None):
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
+
+async def _invalidate(owner_id: int, project_id: int = None):
+    scopes = [cache.owner_scope(owner_id)]
+    if project_id is not None:
+        scopes.append(cache.project_scope(project_id))
+    await cache.bump_generations(*scopes)
 
 # Login request schema
 class LoginRequest(BaseModel):
@@ -22,128 +52,288 @@ class LoginRequest(BaseModel):
 
 # AUTH
 @app.post("/register", response_model=schemas.UserOut)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if crud.get_user_by_email(db, user.email):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    if await crud.get_user_by_email(db, user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db, user)
+    return await crud.create_user(db, user)
 
 @app.post("/login", response_model=schemas.TokenResponse)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, payload.email, payload.password)
+async def login(payload: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user = await auth.authenticate_user(db, payload.email, payload.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = auth.create_access_token(sub=user.email)
+    token = auth.create_access_token(sub=user.email, user_id=user.id)
     return {"access_token": token, "token_type": "bearer"}
 
 # PROJECTS
 @app.post("/projects", response_model=schemas.ProjectOut)
-def create_project(project: schemas.ProjectCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    return crud.create_project(db, project, current_user.id)
+async def create_project(project: schemas.ProjectCreate, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    created_project = await crud.create_project(db, project, current_user.id)
+    await _invalidate(current_user.id)
+    return created_project
 
 @app.get("/projects", response_model=list[schemas.ProjectOut])
-def get_projects(current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    return crud.get_user_projects(db, current_user.id)
+async def get_projects(request: Request, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    async def load():
+        projects = await crud.get_user_projects(db, current_user.id, columns=serialization.PROJECT_OUT_COLUMNS)
+        return serialization.rows_response(projects, serialization.PROJECT_OUT_FIELDS)
+    return await cache.cached_response(request, current_user.id, load)
+
+@app.get("/projects/stats", response_model=list[schemas.ProjectStats])
+async def get_projects_stats(request: Request, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    # overdue counts depend on the day, so the day is part of the cache key.
+    today = date.today()
+    async def load():
+        return _json_response(await crud.get_project_stats(db, current_user.id, today))
+    return await cache.cached_response(request, current_user.id, load, vary=today.isoformat())
+
+@app.get("/projects/{project_id}/stats", response_model=schemas.ProjectStats)
+async def get_project_stats(request: Request, project_id: int, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    today = date.today()
+    async def load():
+        project_stats = await crud.get_project_stats(db, current_user.id, today, project_id=project_id)
+        if not project_stats:
+            raise HTTPException(status_code=404, detail="Project not found or not owned by user")
+        return _json_response(project_stats[0])
+    return await cache.cached_response(request, current_user.id, load, vary=today.isoformat())
 
 @app.get("/projects/{project_id}", response_model=schemas.ProjectOut)
-def get_project_details(
+async def get_project_details(
+    request: Request,
     project_id: int = Path(...),
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    project = crud.get_project(db, project_id, current_user.id)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found or not owned by user")
-    return project
+    async def load():
+        project = await crud.get_project(db, project_id, current_user.id)
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found or not owned by user")
+        return _json_response(schemas.ProjectOut.model_validate(project, from_attributes=True), headers={"ETag": cache.version_etag(project.version)})
+    return await cache.cached_response(request, current_user.id, load, project_id=project_id)
 
 @app.patch("/projects/{project_id}", response_model=schemas.ProjectOut)
-def update_project(project_id: int, project: schemas.ProjectCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    updated_project = crud.update_project(db, project_id, current_user.id, project)
-    if not updated_project:
+async def update_project(project_id: int, project: schemas.ProjectCreate, response: Response, if_match: str = Header(None),
+                         current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    try:
+        updated_project = await crud.update_project(db, project_id, current_user.id, project, cache.if_match_versions(if_match))
+    except crud.NotFound:
         raise HTTPException(status_code=404, detail="Project not found or not owned by user")
+    except crud.VersionConflict:
+        raise HTTPException(status_code=412, detail="Project was modified by another request, fetch it and retry")
+    await _invalidate(current_user.id, project_id)
+    response.headers["ETag"] = cache.version_etag(updated_project.version)
     return updated_project
 
-@app.delete("/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_project(project_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    success = crud.delete_project(db, project_id, current_user.id)
-    if not success:
+@app.delete("/projects/{project_id}", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.ProjectDeletion)
+async def delete_project(project_id: int, if_match: str = Header(None), current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    # The project disappears immediately; its tasks are purged by a background job
+    # whose progress is visible at the Location URL.
+    try:
+        deleted = await crud.delete_project(db, project_id, current_user.id, cache.if_match_versions(if_match))
+    except crud.NotFound:
         raise HTTPException(status_code=404, detail="Project not found or not owned by user")
-    return None
+    except crud.VersionConflict:
+        raise HTTPException(status_code=412, detail="Project was modified by another request, fetch it and retry")
+    await _invalidate(current_user.id, project_id)
+    await events.publish([(project_id, "project.deleted", {"id": project_id})])
+    job_id = None
+    try:
+        job_id = (await run_in_threadpool(purge_project.delay, project_id)).id
+    except Exception:
+        # purge_deleted_projects picks the project up on its next sweep.
+        logger.exception("Could not enqueue purge of project %s", project_id)
+    content = schemas.ProjectDeletion(project_id=project_id, deleted_at=deleted.deleted_at, job_id=job_id)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(content),
+                        headers={"Location": f"/projects/{project_id}/deletion"})
+
+@app.get("/projects/{project_id}/deletion", response_model=schemas.ProjectDeletion)
+async def get_project_deletion(project_id: int, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    deletion = await crud.get_project_deletion(db, project_id, current_user.id)
+    if not deletion:
+        raise HTTPException(status_code=404, detail="No deletion in progress for this project")
+    return deletion
+
+@app.get("/projects/{project_id}/events")
+async def project_events(project_id: int, last_event_id: str = Header(None), current_user: models.User = Depends(auth.get_current_user),
+                         db: AsyncSession = Depends(get_db)):
+    # Server-sent task.created / task.updated / task.deleted events, so boards
+    # need not poll GET /tasks. Reconnecting with Last-Event-ID resumes the feed.
+    if not await crud.get_project(db, project_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Project not found or not owned by user")
+    # Hand the connection back to the pool; the stream may stay open for hours.
+    await db.close()
+    if last_event_id is not None:
+        try:
+            events.event_order(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(events.stream(project_id, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # TASKS
 @app.post("/tasks", response_model=schemas.TaskOut)
-def create_task(task: schemas.TaskCreate, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    project = crud.get_project(db, task.project_id, current_user.id)
+async def create_task(task: schemas.TaskCreate, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    project = await crud.get_project(db, task.project_id, current_user.id)
     if not project:
         raise HTTPException(status_code=403, detail="Project not found or not owned by current user")
-    created_task = crud.create_task(db, task)
-    if task.assigned_user_id:
-        assigned = crud.get_user_by_id(db, task.assigned_user_id)
-        if assigned:
-            send_email_async.delay(assigned.email, "Task Assigned", f"You have been assigned task: {task.title}")
+    created_task = await crud.create_task(db, task)
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.created", [created_task]))
     return created_task
 
 @app.get("/tasks", response_model=list[schemas.TaskOut])
-def get_tasks(status: str = None, priority: int = None, project_id: int = None, due_date: str = None,
-              skip: int = 0, limit: int = 10,
-              current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    tasks = crud.get_tasks_filtered(db, current_user.id, skip=skip, limit=limit, status=status,
-                                    priority=priority, project_id=project_id, due_date=due_date)
-    return tasks
+async def get_tasks(request: Request, status: str = None, priority: int = None, project_id: int = None, due_date: date | None = None,
+                    skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=TASKS_PAGE_MAX_LIMIT), cursor: str = None, sort: str = "id",
+                    current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    # Offset paging is kept for existing clients; the X-Next-Cursor header lets them
+    # switch to keyset paging, which costs the same at any depth.
+    async def load():
+        next_cursor = None
+        if skip and not cursor:
+            if sort != "id":
+                raise HTTPException(status_code=400, detail="skip is only supported with sort=id, use cursor instead")
+            tasks = await crud.get_tasks_filtered(db, current_user.id, skip=skip, limit=limit, status=status,
+                                                  priority=priority, project_id=project_id, due_date=due_date,
+                                                  columns=serialization.TASK_OUT_COLUMNS)
+        else:
+            try:
+                tasks, next_cursor = await crud.get_tasks_page(db, current_user.id, limit=limit, cursor=cursor, sort=sort, status=status,
+                                                               priority=priority, project_id=project_id, due_date=due_date,
+                                                               columns=serialization.TASK_OUT_COLUMNS)
+            except pagination.InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return serialization.rows_response(tasks, serialization.TASK_OUT_FIELDS, headers=headers)
+    return await cache.cached_response(request, current_user.id, load)
+
+@app.get("/tasks/search", response_model=list[schemas.TaskOut])
+async def search_tasks(request: Request, q: str, limit: int = Query(10, ge=1, le=TASKS_PAGE_MAX_LIMIT), cursor: str = None,
+                       current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    async def load():
+        try:
+            tasks, next_cursor = await crud.search_tasks(db, current_user.id, q, limit=limit, cursor=cursor)
+        except (pagination.InvalidCursor, search.InvalidSearchQuery) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return _json_response([schemas.TaskOut.model_validate(t, from_attributes=True) for t in tasks], headers=headers)
+    return await cache.cached_response(request, current_user.id, load)
+
+@app.get("/tasks/export")
+async def export_tasks(format: str = "ndjson", status: str = None, priority: int = None, project_id: int = None, due_date: date | None = None,
+                       current_user: models.User = Depends(auth.get_current_user)):
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(export.EXPORT_FORMATS)}")
+    body = export.stream_tasks(current_user.id, format, status=status, priority=priority, project_id=project_id, due_date=due_date)
+    return StreamingResponse(body, media_type=export.EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f"attachment; filename=tasks.{format}"})
+
+# BULK TASKS
+def _check_bulk_size(items):
+    if len(items) > TASKS_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {TASKS_BULK_MAX_ITEMS} items per request")
+
+def _task_out(row):
+    return schemas.TaskOut(**{field: row[field] for field in crud.TASK_FIELDS}, id=row["id"])
+
+@app.post("/tasks/bulk", response_model=list[schemas.TaskBulkResult])
+async def bulk_create_tasks(tasks: list[schemas.TaskCreate], current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    _check_bulk_size(tasks)
+    owned = await crud.get_owned_project_ids(db, current_user.id, {t.project_id for t in tasks})
+    accepted = [(i, t) for i, t in enumerate(tasks) if t.project_id in owned]
+    created = await crud.bulk_create_tasks(db, [t for _, t in accepted])
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.created", created))
+
+    results = [schemas.TaskBulkResult(index=i, status_code=403, detail="Project not found or not owned by current user")
+               for i, t in enumerate(tasks) if t.project_id not in owned]
+    results += [schemas.TaskBulkResult(index=i, id=row["id"], status_code=201, task=_task_out(row))
+                for (i, _), row in zip(accepted, created)]
+    results.sort(key=lambda r: r.index)
+    return results
+
+@app.patch("/tasks/bulk", response_model=list[schemas.TaskBulkResult])
+async def bulk_update_tasks(updates: list[schemas.TaskBulkUpdate], current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    _check_bulk_size(updates)
+    existing = await crud.get_owned_tasks(db, current_user.id, {u.id for u in updates})
+    results, rows, seen = [], [], set()
+    for i, u in enumerate(updates):
+        if u.id in seen:
+            results.append(schemas.TaskBulkResult(index=i, id=u.id, status_code=400, detail="Duplicate task id in batch"))
+            continue
+        seen.add(u.id)
+        if u.id not in existing:
+            results.append(schemas.TaskBulkResult(index=i, id=u.id, status_code=404, detail="Task not found or not owned by user"))
+            continue
+        if u.version is not None and u.version != existing[u.id].version:
+            results.append(schemas.TaskBulkResult(index=i, id=u.id, status_code=412, detail=VERSION_CONFLICT))
+            continue
+        # Like PATCH /tasks/{task_id}, a bulk update never moves a task to another project.
+        row = {field: getattr(u, field) for field in crud.TASK_FIELDS}
+        row.update(id=u.id, project_id=existing[u.id].project_id)
+        rows.append((i, row))
+    updated = await crud.bulk_update_tasks(db, current_user.id, [row for _, row in rows], existing)
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.updated", updated))
+    applied = {row["id"] for row in updated}
+    results += [schemas.TaskBulkResult(index=i, id=row["id"], status_code=200, task=_task_out(row)) if row["id"] in applied
+                else schemas.TaskBulkResult(index=i, id=row["id"], status_code=412, detail=VERSION_CONFLICT)
+                for i, row in rows]
+    results.sort(key=lambda r: r.index)
+    return results
+
+@app.delete("/tasks/bulk", response_model=list[schemas.TaskBulkResult])
+async def bulk_delete_tasks(payload: schemas.TaskBulkDelete, current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    _check_bulk_size(payload.ids)
+    deleted = await crud.bulk_delete_tasks(db, current_user.id, set(payload.ids))
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.deleted", deleted))
+    deleted_ids = {task.id for task in deleted}
+    return [schemas.TaskBulkResult(index=i, id=task_id, status_code=204) if task_id in deleted_ids
+            else schemas.TaskBulkResult(index=i, id=task_id, status_code=404, detail="Task not found or not owned by user")
+            for i, task_id in enumerate(payload.ids)]
 
 @app.get("/tasks/{task_id}", response_model=schemas.TaskOut)
-def get_task_details(
+async def get_task_details(
+    request: Request,
     task_id: int = Path(...),
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    task = crud.get_task_with_owner(db, task_id, current_user.id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found or not owned by user")
-    return task
+    async def load():
+        task = await crud.get_task_with_owner(db, task_id, current_user.id)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found or not owned by user")
+        return _json_response(schemas.TaskOut.model_validate(task, from_attributes=True), headers={"ETag": cache.version_etag(task.version)})
+    return await cache.cached_response(request, current_user.id, load)
 
 @app.patch("/tasks/{task_id}", response_model=schemas.TaskOut)
-def update_task(task_id: int, task_update: schemas.TaskCreate, background_tasks: BackgroundTasks, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    db_task = crud.get_task(db, task_id)
-    if not db_task:
+async def update_task(task_id: int, task_update: schemas.TaskCreate, response: Response, if_match: str = Header(None),
+                      current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    # Ownership check, version check and update are one statement; counters and
+    # outbox notifications are written in the same transaction.
+    try:
+        updated_task = await crud.update_task(db, task_id, current_user.id, task_update, cache.if_match_versions(if_match))
+    except crud.NotFound:
         raise HTTPException(status_code=404, detail="Task not found")
-
-    project = crud.get_project(db, db_task.project_id, current_user.id)
-    if not project:
+    except crud.NotOwned:
         raise HTTPException(status_code=403, detail="Not authorized to update task")
-
-    old_assigned_user_id = db_task.assigned_user_id
-    old_status = db_task.status
-
-    # Update fields
-    db_task.title = task_update.title
-    db_task.description = task_update.description
-    db_task.status = task_update.status
-    db_task.priority = task_update.priority
-    db_task.due_date = task_update.due_date
-    db_task.assigned_user_id = task_update.assigned_user_id
-
-    db.commit()
-    db.refresh(db_task)
-
-    if task_update.assigned_user_id and task_update.assigned_user_id != old_assigned_user_id:
-        assigned_user = crud.get_user_by_id(db, task_update.assigned_user_id)
-        if assigned_user:
-            send_email_async.delay(assigned_user.email, "Task Assigned", f"You have been assigned task: {db_task.title}")
-    elif old_status != task_update.status:
-        assigned_user = crud.get_user_by_id(db, db_task.assigned_user_id)
-        if assigned_user:
-            email_utils.send_email_background(background_tasks, assigned_user.email, "Task Status Updated", f"Status of task '{db_task.title}' changed to {db_task.status}")
-
-    return db_task
+    except crud.VersionConflict:
+        raise HTTPException(status_code=412, detail=VERSION_CONFLICT)
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.updated", [updated_task]))
+    response.headers["ETag"] = cache.version_etag(updated_task["version"])
+    return updated_task
 
 @app.delete("/tasks/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_task(task_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
-    db_task = crud.get_task(db, task_id)
-    if not db_task:
+async def delete_task(task_id: int, if_match: str = Header(None), current_user: models.User = Depends(auth.get_current_user), db: AsyncSession = Depends(get_db)):
+    try:
+        deleted_task = await crud.delete_task(db, task_id, current_user.id, cache.if_match_versions(if_match))
+    except crud.NotFound:
         raise HTTPException(status_code=404, detail="Task not found")
-    project = crud.get_project(db, db_task.project_id, current_user.id)
-    if not project:
+    except crud.NotOwned:
         raise HTTPException(status_code=403, detail="Not authorized to delete task")
-    db.delete(db_task)
-    db.commit()
+    except crud.VersionConflict:
+        raise HTTPException(status_code=412, detail=VERSION_CONFLICT)
+    await _invalidate(current_user.id)
+    await events.publish(events.task_events("task.deleted", [deleted_task]))
     return None
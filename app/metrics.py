@@ -0,0 +1,208 @@
+import contextvars
+import hmac
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+# /metrics answers a request carrying "Authorization: Bearer <METRICS_TOKEN>", or one
+# whose direct peer is in METRICS_ALLOWED_IPS (comma-separated addresses or networks).
+# Behind a reverse proxy every request comes from the proxy's address, so use the token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_ALLOWED_IPS = [ipaddress.ip_network(net.strip(), strict=False)
+                       for net in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if net.strip()]
+# A statement repeated this many times within one request is reported as a likely N+1.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# Metrics are per process; with several uvicorn workers each one serves its own /metrics.
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, tuple(labels), buckets
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0] * len(self.buckets))
+        self._sums = defaultdict(float)
+        self._totals = defaultdict(int)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            counts = self._counts[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[labels] += value
+            self._totals[labels] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, labels)]
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{{{','.join(pairs + [_le(bound)])}}} {count}")
+                lines.append(f"{self.name}_bucket{{{','.join(pairs + [_le('+Inf')])}}} {self._totals[labels]}")
+                suffix = f"{{{','.join(pairs)}}}" if pairs else ""
+                lines.append(f"{self.name}_sum{suffix} {self._sums[labels]}")
+                lines.append(f"{self.name}_count{suffix} {self._totals[labels]}")
+        return lines
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = Counter()
+
+    def inc(self, *labels, amount: int = 1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, labels))
+                lines.append(f"{self.name}{{{pairs}}} {value}" if pairs else f"{self.name} {value}")
+        return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _le(bound):
+    return f'le="{bound}"'
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements issued per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram("http_request_db_duration_seconds", "Time spent in SQL per HTTP request.", ("method", "route"))
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.", ("pool",))
+CELERY_ENQUEUE_LATENCY = Histogram("celery_enqueue_duration_seconds", "Time to publish a Celery task to the broker.", ("task",))
+N_PLUS_ONE = CounterMetric("db_n_plus_one_total", "Requests that repeated one SQL statement at least N_PLUS_ONE_THRESHOLD times.", ("method", "route"))
+
+REGISTRY = (REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME, POOL_CHECKOUT_WAIT, CELERY_ENQUEUE_LATENCY, N_PLUS_ONE)
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+def scrape_allowed(client_host: str, authorization: str):
+    if METRICS_TOKEN and authorization and hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(client_host)
+    except (TypeError, ValueError):
+        return False
+    return any(address in net for net in METRICS_ALLOWED_IPS)
+
+# ---------- SQL ----------
+class RequestStats:
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+
+# Set by the middleware; contextvars follow the request into threadpools and
+# SQLAlchemy's async greenlets, so cursor hooks can attribute queries to it.
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+# The start time lives on the statement's execution context rather than the pooled
+# connection: after_cursor_execute does not fire for a statement that raises.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_query_start
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        stats.statements[statement] += 1
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+# Pool classes that time every checkout, including the wait for a free
+# connection when the pool is exhausted.
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, "sync")
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, "async")
+
+# ---------- CELERY ----------
+_publish_started = {}
+
+def _before_task_publish(sender=None, headers=None, **kwargs):
+    _publish_started[headers["id"]] = time.perf_counter()
+
+def _after_task_publish(sender=None, headers=None, **kwargs):
+    started = _publish_started.pop(headers["id"], None)
+    if started is not None:
+        CELERY_ENQUEUE_LATENCY.observe(time.perf_counter() - started, sender)
+
+def instrument_celery():
+    from celery.signals import after_task_publish, before_task_publish
+    before_task_publish.connect(_before_task_publish, weak=False)
+    after_task_publish.connect(_after_task_publish, weak=False)
+
+# ---------- HTTP ----------
+def _route_label(scope):
+    # The matched route template, not the raw path, to keep label cardinality bounded.
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    total = (time.perf_counter() - started) * 1000
+                    value = f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", app;dur={total:.2f}'
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            method, route = scope["method"], _route_label(scope)
+            REQUEST_LATENCY.observe(time.perf_counter() - started, method, route, status_code)
+            REQUEST_QUERIES.observe(stats.queries, method, route)
+            REQUEST_DB_TIME.observe(stats.db_time, method, route)
+            repeated = [(statement, n) for statement, n in stats.statements.items() if n >= N_PLUS_ONE_THRESHOLD]
+            if repeated:
+                N_PLUS_ONE.inc(method, route)
+                for statement, n in repeated:
+                    logger.warning("Possible N+1 in %s %s: statement ran %d times: %s", method, route, n, " ".join(statement.split())[:300])
@@ -0,0 +1,22 @@
+from sqlalchemy import inspect
+from . import database, models, search, stats
+
+# Brings the schema up to date: missing tables, columns and indexes, the search
+# index, and a counter backfill the first time the counters table appears. Run it
+# once per deploy before starting the API, not at import in every worker, where
+# concurrent startups race on the same DDL:
+#
+#   python -m app.migrate
+def migrate(engine=None):
+    engine = engine or database.engine
+    counters_missing = not inspect(engine).has_table(models.ProjectTaskCounter.__tablename__)
+    models.Base.metadata.create_all(bind=engine)
+    database.add_missing_columns(engine, models.Base.metadata)
+    if counters_missing:
+        with database.SessionLocal(bind=engine) as session:
+            stats.reconcile(session)
+    search.ensure_search_index(engine)
+
+if __name__ == "__main__":
+    migrate()
+    print("schema is up to date")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -16,10 +17,23 @@ class Project(Base):
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # Bumped on every update; served as the ETag and checked against If-Match.
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Set by DELETE /projects/{id}; the project is hidden at once and its tasks are purged in the background.
+    deleted_at = Column(DateTime, nullable=True)
+    # Lease held by the purge job working on a deleted project, renewed every batch.
+    purge_claimed_at = Column(DateTime, nullable=True)
+    purge_claim_token = Column(String, nullable=True)
 
     owner = relationship("User", back_populates="projects")
     tasks = relationship("Task", back_populates="project")
 
+    __table_args__ = (
+        Index("ix_projects_owner_id_id", "owner_id", "id"),
+        Index("ix_projects_deleted_at", "deleted_at",
+              sqlite_where=text("deleted_at IS NOT NULL"), postgresql_where=text("deleted_at IS NOT NULL")),
+    )
+
 class Task(Base):
     __tablename__ = "tasks"
     id = Column(Integer, primary_key=True, index=True)
@@ -30,5 +44,60 @@ class Task(Base):
     due_date = Column(Date, nullable=True)
     project_id = Column(Integer, ForeignKey("projects.id"))
     assigned_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
 
     project = relationship("Project", back_populates="tasks")
+
+    # Every index ends in id so a keyset page over (sort key, id) is one range seek.
+    # With project_id, GET /tasks filters on status or priority are indexed for every
+    # sort; status and priority together with sort=due_date seek on both and sort the
+    # matches. Without project_id the tasks of each of the owner's projects are
+    # read by these indexes and merged with a sort bounded by the owner's matching
+    # rows; tasks carry no owner_id, so no index can order across projects.
+    # A due_date filter is served by the project_id + due_date prefix.
+    __table_args__ = (
+        Index("ix_tasks_project_id_id", "project_id", "id"),
+        Index("ix_tasks_project_due_date_id", "project_id", "due_date", "id"),
+        Index("ix_tasks_project_priority_id", "project_id", "priority", "id"),
+        Index("ix_tasks_project_priority_due_date_id", "project_id", "priority", "due_date", "id"),
+        Index("ix_tasks_project_status_id", "project_id", "status", "id"),
+        Index("ix_tasks_project_status_due_date_id", "project_id", "status", "due_date", "id"),
+        Index("ix_tasks_project_status_priority_id", "project_id", "status", "priority", "id"),
+        # Partial index over open tasks only: the overdue digest walks each owner's
+        # projects in id order and reads their overdue tasks in due_date order from it.
+        Index("ix_tasks_undone_project_due_date_id", "project_id", "due_date", "id",
+              sqlite_where=text("status != 'done'"), postgresql_where=text("status != 'done'")),
+    )
+
+class ProjectTaskCounter(Base):
+    __tablename__ = "project_task_counters"
+    # kind is "total", "status", "priority" or "due" (open tasks by due date, for overdue counts).
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    kind = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    # Written in the same transaction as the task change; drained by Celery.
+    # task_id has no foreign key so deleting a task never blocks on its pending notifications.
+    id = Column(Integer, primary_key=True)
+    recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    task_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # "assigned" or "status_changed"
+    task_title = Column(String, nullable=False)
+    status = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=_utcnow)
+    claimed_at = Column(DateTime, nullable=True)
+    claim_token = Column(String, nullable=True)  # the drain run holding the claim
+    delivery_key = Column(String, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_pending", "recipient_id", "created_at",
+              sqlite_where=text("sent_at IS NULL"), postgresql_where=text("sent_at IS NULL")),
+        Index("ix_notification_outbox_sent_at", "sent_at"),
+    )
@@ -0,0 +1,106 @@
+import os
+import uuid
+from datetime import timedelta
+from itertools import groupby
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from . import email_utils, models
+
+# A recipient's notifications wait this long after the oldest pending one, so
+# rapid edits to their tasks are folded into a single email.
+OUTBOX_COALESCE_WINDOW = float(os.getenv("OUTBOX_COALESCE_WINDOW", 30))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 1000))
+# Claimed but unsent events (e.g. the worker died mid-send) are retried after this.
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", 300))
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", 86400))
+
+SUBJECTS = {"assigned": "Task Assigned", "status_changed": "Task Status Updated"}
+
+def _get(obj, field):
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+# Outbox rows for a task write; old is None for inserts. Mirrors the emails the
+# handlers used to send inline: assignment first, otherwise a status change.
+def task_events(new, old=None):
+    assignee = _get(new, "assigned_user_id")
+    if not assignee:
+        return []
+    event = {"recipient_id": assignee, "task_id": _get(new, "id"), "task_title": _get(new, "title"), "status": _get(new, "status")}
+    if old is None or assignee != _get(old, "assigned_user_id"):
+        return [dict(event, kind="assigned")]
+    if _get(old, "status") != event["status"]:
+        return [dict(event, kind="status_changed")]
+    return []
+
+# Call before commit so the notifications are durable exactly when the change is.
+async def enqueue(db, events):
+    if events:
+        await db.execute(insert(models.NotificationOutbox), events)
+
+def _line(event):
+    if event.kind == "assigned":
+        return f"You have been assigned task: {event.task_title}"
+    return f"Status of task '{event.task_title}' changed to {event.status}"
+
+def compose(events):
+    # The latest event per (task, kind) wins, so a burst of edits reports only the final state.
+    latest = {(e.task_id, e.kind): e for e in events}
+    if len(latest) == 1:
+        (event,) = latest.values()
+        return SUBJECTS[event.kind], _line(event)
+    return f"{len(latest)} task updates", "\n".join(_line(e) for e in latest.values())
+
+def _deliveries(events):
+    # Groups keep the delivery_key of an earlier, unfinished attempt so a retry
+    # goes out with the same idempotency key; new events get a fresh one.
+    for recipient_id, rows in groupby(events, key=lambda e: e.recipient_id):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row.delivery_key, []).append(row)
+        fresh = groups.pop(None, None)
+        if fresh:
+            groups[f"notify-{recipient_id}-{fresh[0].id}-{fresh[-1].id}"] = fresh
+        yield from groups.items()
+
+def drain(db, now=None):
+    # Delivers at least once: events are claimed and committed, sent, then marked
+    # sent. A crash in between re-sends them later under the same key.
+    o = models.NotificationOutbox
+    now = now or models._utcnow()
+    token = uuid.uuid4().hex
+    claimable = and_(o.sent_at.is_(None), or_(o.claimed_at.is_(None), o.claimed_at < now - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)))
+    ready = select(o.recipient_id).where(claimable).group_by(o.recipient_id).having(
+        func.min(o.created_at) <= now - timedelta(seconds=OUTBOX_COALESCE_WINDOW)
+    )
+    candidates = db.execute(
+        select(o.id).where(claimable, o.recipient_id.in_(ready)).order_by(o.recipient_id, o.id)
+        .limit(OUTBOX_BATCH_SIZE).with_for_update(skip_locked=True)
+    ).scalars().all()
+    # The claim re-checks claimable row by row, so of two overlapping drains only
+    # one takes each event, also where SKIP LOCKED does not exist (SQLite).
+    claimed = db.execute(
+        update(o).where(o.id.in_(candidates), claimable).values(claimed_at=now, claim_token=token)
+        .returning(o.id).execution_options(synchronize_session=False)
+    ).all() if candidates else []
+    db.execute(delete(o).where(o.sent_at < now - timedelta(seconds=OUTBOX_RETENTION)))
+    if not claimed:
+        db.commit()
+        return 0
+    events = db.execute(
+        select(o.id, o.recipient_id, o.task_id, o.kind, o.task_title, o.status, o.delivery_key, models.User.email)
+        .outerjoin(models.User, models.User.id == o.recipient_id)
+        .where(o.id.in_([row.id for row in claimed]))
+        .order_by(o.recipient_id, o.id)
+    ).all()
+    deliveries = list(_deliveries(events))
+    for key, rows in deliveries:
+        db.execute(update(o).where(o.id.in_([r.id for r in rows])).values(delivery_key=key).execution_options(synchronize_session=False))
+    db.commit()
+
+    messages = [(rows[0].email, *compose(rows), key) for key, rows in deliveries if rows[0].email]
+    if messages:
+        email_utils.send_email_batch(messages)
+    # Refused recipients are logged by the SMTP pool and not retried. A claim that
+    # timed out and was taken over is left to the drain now holding it.
+    db.execute(update(o).where(o.id.in_([e.id for e in events]), o.claim_token == token).values(sent_at=now).execution_options(synchronize_session=False))
+    db.commit()
+    return len(events)
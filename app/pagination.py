@@ -0,0 +1,35 @@
+import base64
+import json
+from datetime import date
+
+# Sort orders accepted by GET /tasks; each is paired with Task.id as tie-breaker
+# so the (key, id) tuple is unique and can be resumed from.
+TASK_SORT_KEYS = ("id", "due_date", "priority")
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(sort: str, key, last_id: int) -> str:
+    if isinstance(key, date):
+        key = key.isoformat()
+    raw = json.dumps([sort, key, last_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key, last_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if cursor_sort != sort or not isinstance(last_id, int):
+        raise InvalidCursor("Cursor does not match the requested sort order")
+    if sort == "due_date" and key is not None:
+        try:
+            key = date.fromisoformat(key)
+        except (ValueError, TypeError):
+            raise InvalidCursor("Invalid cursor")
+    if sort == "priority" and key is not None and (not isinstance(key, int) or isinstance(key, bool)):
+        raise InvalidCursor("Invalid cursor")
+    if sort == "rank" and not isinstance(key, (int, float)):
+        raise InvalidCursor("Invalid cursor")
+    return key, last_id
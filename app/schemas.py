@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-from datetime import date
+from datetime import date, datetime
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -39,3 +39,31 @@ class TaskOut(TaskCreate):
     id: int
     class Config:
         orm_mode = True
+
+class TaskBulkUpdate(TaskCreate):
+    id: int
+    # Expected current version, like If-Match on PATCH /tasks/{id}.
+    version: Optional[int] = None
+
+class TaskBulkDelete(BaseModel):
+    ids: list[int]
+
+class TaskBulkResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    status_code: int
+    task: Optional[TaskOut] = None
+    detail: Optional[str] = None
+
+class ProjectStats(BaseModel):
+    project_id: int
+    total: int
+    by_status: dict[str, int]
+    by_priority: dict[str, int]
+    overdue: int
+
+class ProjectDeletion(BaseModel):
+    project_id: int
+    deleted_at: datetime
+    remaining_tasks: Optional[int] = None
+    job_id: Optional[str] = None
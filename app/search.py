@@ -0,0 +1,65 @@
+import re
+from sqlalchemy import column, func, inspect, literal_column, select, table, text
+from . import models
+
+# SQLite: an external-content FTS5 table over tasks, kept in sync by triggers so
+# every write path (ORM, bulk executemany, raw SQL) updates the index.
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "title, description, content='tasks', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF title, description ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+)
+
+# Postgres: a stored generated tsvector (maintained by the database on every
+# insert/update) with a GIN index. Titles weigh more than descriptions.
+POSTGRES_FTS_DDL = (
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_search_vector ON tasks USING GIN (search_vector)",
+)
+
+class InvalidSearchQuery(ValueError):
+    pass
+
+def ensure_search_index(engine):
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            created = not inspect(conn).has_table("tasks_fts")
+            for statement in SQLITE_FTS_DDL:
+                conn.execute(text(statement))
+            if created:
+                conn.execute(text("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"))
+        elif conn.dialect.name == "postgresql":
+            for statement in POSTGRES_FTS_DDL:
+                conn.execute(text(statement))
+
+def _fts5_query(q: str):
+    # Quote every token so user input can never be parsed as FTS5 syntax.
+    tokens = re.findall(r"\w+", q)
+    if not tokens:
+        raise InvalidSearchQuery("Search query must contain at least one word")
+    return " ".join(f'"{token}"' for token in tokens)
+
+# Returns (select of Task rows matching q, rank expression); lower ranks are better.
+def search_query(dialect_name: str, q: str):
+    if dialect_name == "sqlite":
+        fts = table("tasks_fts", column("rowid"))
+        fts_ref = literal_column("tasks_fts")
+        rank = func.bm25(fts_ref, 10.0, 1.0)
+        stmt = select(models.Task).join(fts, fts.c.rowid == models.Task.id).where(fts_ref.op("MATCH")(_fts5_query(q)))
+        return stmt, rank
+    if dialect_name == "postgresql":
+        if not q.strip():
+            raise InvalidSearchQuery("Search query must contain at least one word")
+        vector = literal_column("tasks.search_vector")
+        tsquery = func.websearch_to_tsquery("english", q)
+        stmt = select(models.Task).where(vector.op("@@")(tsquery))
+        return stmt, -func.ts_rank_cd(vector, tsquery)
+    raise InvalidSearchQuery(f"Full-text search is not supported on {dialect_name}")
@@ -0,0 +1,19 @@
+import orjson
+from fastapi import Response
+from . import models, schemas
+
+# Fast path for list endpoints: select exactly the response model's columns as
+# Core rows and encode them with orjson, skipping ORM hydration, pydantic
+# validation and jsonable_encoder. Fields follow the models' declaration order,
+# so the body is byte-for-byte what JSONResponse produced from the validated
+# models (python -m bench.serialization checks this).
+TASK_OUT_FIELDS = tuple(schemas.TaskOut.model_fields)
+TASK_OUT_COLUMNS = tuple(getattr(models.Task, field) for field in TASK_OUT_FIELDS)
+PROJECT_OUT_FIELDS = tuple(schemas.ProjectOut.model_fields)
+PROJECT_OUT_COLUMNS = tuple(getattr(models.Project, field) for field in PROJECT_OUT_FIELDS)
+
+def dump_rows(rows, fields):
+    return orjson.dumps([dict(zip(fields, row)) for row in rows])
+
+def rows_response(rows, fields, headers=None):
+    return Response(dump_rows(rows, fields), media_type="application/json", headers=headers)
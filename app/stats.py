@@ -0,0 +1,130 @@
+import argparse
+from collections import Counter
+from sqlalchemy import and_, case, delete, false, func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from . import models
+
+# Per-project task counters, maintained in the same transaction as every task
+# write. reconcile() recomputes them from the tasks table to repair drift.
+_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def _state(task):
+    if isinstance(task, dict):
+        return task["project_id"], task["status"], task["priority"], task["due_date"]
+    return task.project_id, task.status, task.priority, task.due_date
+
+def is_open(status):
+    return status is not None and status != "done"
+
+def counter_keys(project_id, status, priority, due_date):
+    keys = [(project_id, "total", "")]
+    if status is not None:
+        keys.append((project_id, "status", status))
+    if priority is not None:
+        keys.append((project_id, "priority", str(priority)))
+    if due_date is not None and is_open(status):
+        keys.append((project_id, "due", due_date.isoformat()))
+    return keys
+
+# old/new are Task rows, ORM objects or dicts; pass None for inserts and deletes.
+def counter_deltas(old=None, new=None, deltas=None):
+    deltas = Counter() if deltas is None else deltas
+    if old is not None:
+        deltas.subtract(counter_keys(*_state(old)))
+    if new is not None:
+        deltas.update(counter_keys(*_state(new)))
+    return deltas
+
+def upsert_counters(dialect_name: str, deltas):
+    # Sorted so concurrent writers lock the counter rows in the same order and cannot deadlock.
+    rows = [{"project_id": p, "kind": k, "value": v, "count": n} for (p, k, v), n in sorted(deltas.items()) if n]
+    if not rows:
+        return None
+    stmt = _INSERTS[dialect_name](models.ProjectTaskCounter).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["project_id", "kind", "value"],
+        set_={"count": models.ProjectTaskCounter.count + stmt.excluded.count},
+    )
+
+def stats_query(owner_id: int, today, project_id: int = None):
+    # Due-date counters collapse to overdue/upcoming in SQL, so the result is
+    # O(projects x (statuses + priorities)) rows whatever the task count.
+    c = models.ProjectTaskCounter
+    bucket = case(
+        (and_(c.kind == "due", c.value < today.isoformat()), "overdue"),
+        (c.kind == "due", "upcoming"),
+        else_=c.value,
+    )
+    q = select(models.Project.id.label("project_id"), c.kind, bucket.label("bucket"), func.sum(c.count).label("n")).select_from(
+        models.Project
+    ).outerjoin(c, c.project_id == models.Project.id).where(models.Project.owner_id == owner_id, models.Project.deleted_at.is_(None))
+    if project_id is not None:
+        q = q.where(models.Project.id == project_id)
+    return q.group_by(models.Project.id, c.kind, bucket).order_by(models.Project.id)
+
+def build_stats(rows):
+    projects = {}
+    for row in rows:
+        stats = projects.setdefault(row.project_id, {"project_id": row.project_id, "total": 0, "by_status": {}, "by_priority": {}, "overdue": 0})
+        if row.kind == "total":
+            stats["total"] = row.n
+        elif row.kind == "status" and row.n:
+            stats["by_status"][row.bucket] = row.n
+        elif row.kind == "priority" and row.n:
+            stats["by_priority"][row.bucket] = row.n
+        elif row.kind == "due" and row.bucket == "overdue":
+            stats["overdue"] = row.n
+    return list(projects.values())
+
+def _actual_counters(db, project_id: int = None):
+    t = models.Task
+    q = select(t.project_id, t.status, t.priority, t.due_date, func.count().label("n")).join(
+        models.Project, t.project_id == models.Project.id
+    ).group_by(t.project_id, t.status, t.priority, t.due_date)
+    if project_id is not None:
+        q = q.where(t.project_id == project_id)
+    actual = Counter()
+    for row in db.execute(q):
+        for key in counter_keys(row.project_id, row.status, row.priority, row.due_date):
+            actual[key] += row.n
+    return actual
+
+def _lock_counters(db):
+    # Held until reconcile commits. A task write commits together with its counter
+    # upsert, so it is either in both the stored and the actual read, or in neither
+    # and applies its delta after the repair.
+    c = models.ProjectTaskCounter
+    if db.bind.dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {c.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+    else:
+        # SQLite has a single writer; any write statement holds that lock to the end of the transaction.
+        db.execute(delete(c).where(false()))
+
+def reconcile(db, project_id: int = None):
+    c = models.ProjectTaskCounter
+    _lock_counters(db)
+    q = select(c.project_id, c.kind, c.value, c.count)
+    if project_id is not None:
+        q = q.where(c.project_id == project_id)
+    stored = {(row.project_id, row.kind, row.value): row.count for row in db.execute(q)}
+    actual = _actual_counters(db, project_id)
+    drift = Counter({key: actual.get(key, 0) - count for key, count in stored.items()})
+    drift.update({key: n for key, n in actual.items() if key not in stored})
+    drift = Counter({key: n for key, n in drift.items() if n})
+    stmt = upsert_counters(db.bind.dialect.name, drift)
+    if stmt is not None:
+        db.execute(stmt)
+    zeroed = delete(c).where(c.count == 0)
+    if project_id is not None:
+        zeroed = zeroed.where(c.project_id == project_id)
+    db.execute(zeroed)
+    db.commit()
+    return len(drift)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild per-project task counters from the tasks table.")
+    parser.add_argument("--project-id", type=int, default=None)
+    args = parser.parse_args()
+    from .database import SessionLocal
+    with SessionLocal() as session:
+        print(f"corrected {reconcile(session, args.project_id)} counters")
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+# In-process load run against app.main:app over SQLite. Celery runs eagerly and
+# SMTP goes to a null pool, so nothing leaves the process:
+#
+#   python -m bench --tasks 100000 --requests 500 --concurrency 16 --output run.json
+#   python -m bench --baseline bench/baseline.json --fail-on-regression
+#   python -m bench --baseline bench/baseline.json --save-baseline
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the Task Manager API in-process.")
+    parser.add_argument("--db", default="bench.db", help="SQLite file; seeded on first use")
+    parser.add_argument("--tasks", type=int, default=10000, help="tasks to seed when the database is created")
+    parser.add_argument("--users", type=int, default=None, help="users to seed (default: one per 1000 tasks)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=None, help="comma-separated subset to run")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache on (off by default so every request hits the database)")
+    parser.add_argument("--output", default=None, help="write this run's results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite --baseline with this run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown before a scenario counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args()
+
+def _configure_env(args):
+    # Must run before anything under app/ is imported: settings are read at import time.
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ.pop("CACHE_REDIS_URL", None)
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ["CELERY_BACKEND_URL"] = "cache+memory://"
+    os.environ["OUTBOX_COALESCE_WINDOW"] = "0"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "true" if args.response_cache else "false"
+
+class _NullSMTPPool:
+    def __init__(self):
+        self.sent = 0
+
+    def send_messages(self, messages):
+        self.sent += sum(1 for _ in messages)
+        return []
+
+class QueryCounter:
+    def __init__(self, *engines):
+        from sqlalchemy import event
+        self.count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+def _install_stubs():
+    from app import email_utils
+    from app.celery_worker import celery
+    celery.conf.update(task_always_eager=True, task_store_eager_result=False)
+    celery.finalize()
+    email_utils._pool = _NullSMTPPool()
+    return email_utils._pool
+
+def percentile(samples, pct):
+    # Nearest-rank percentile over sorted samples.
+    if not samples:
+        return None
+    rank = max(1, -(-len(samples) * pct // 100))
+    return samples[int(rank) - 1]
+
+async def run_scenario(client, ctx, fn, iterations, concurrency, queries):
+    latencies, errors = [], 0
+    counter = iter(range(iterations))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            status = await fn(client, ctx, i)
+            latencies.append(time.perf_counter() - started)
+            if status is not None and not (200 <= status < 300 or status == 304):
+                errors += 1
+
+    before = queries.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "queries_per_request": round((queries.count - before) / len(latencies), 2) if latencies else None,
+    }
+
+async def run(args, dataset):
+    import httpx
+    from app import database
+    from app.main import app
+    from .scenarios import SCENARIOS, Context
+
+    queries = QueryCounter(database.engine, database.async_engine.sync_engine)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        ctx = Context(dataset["users"])
+        await ctx.setup(client, args.concurrency)
+        for name in names:
+            fn, cap = SCENARIOS[name]
+            iterations = min(args.requests, cap) if cap else args.requests
+            results[name] = await run_scenario(client, ctx, fn, iterations, args.concurrency, queries)
+            print(_format_row(name, results[name]), flush=True)
+    return results
+
+def _format_row(name, r):
+    return (f"{name:<22} n={r['requests']:<5} err={r['errors']:<3} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+            f"p99={r['p99_ms']}ms rps={r['throughput_rps']} queries/req={r['queries_per_request']}")
+
+def compare(results, baseline, tolerance):
+    # Returns the names of scenarios that got slower than tolerance allows or issue more queries.
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not base.get("p95_ms") or r["p95_ms"] is None:
+            print(f"{name:<22} no baseline")
+            continue
+        change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"]
+        query_change = (r["queries_per_request"] or 0) - (base["queries_per_request"] or 0)
+        regressed = change > tolerance or query_change > 0
+        print(f"{name:<22} p95 {base['p95_ms']} -> {r['p95_ms']}ms ({change:+.0%}), "
+              f"queries/req {base['queries_per_request']} -> {r['queries_per_request']}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main():
+    args = _parse_args()
+    _configure_env(args)
+    from . import seed
+
+    if os.path.exists(args.db):
+        from sqlalchemy import func, select
+        from app import database, migrate, models
+        migrate.migrate(database.engine)
+        with database.SessionLocal() as session:
+            dataset = {
+                "users": session.scalar(select(func.count()).select_from(models.User).where(models.User.email.like("bench%@example.com"))),
+                "projects": session.scalar(select(func.count()).select_from(models.Project)),
+                "tasks": session.scalar(select(func.count()).select_from(models.Task)),
+                "seed": None,
+            }
+    else:
+        dataset = seed.seed(args.tasks, args.users, seed=args.seed)
+    smtp = _install_stubs()
+
+    results = asyncio.run(run(args, dataset))
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "dataset": dataset,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "response_cache": args.response_cache,
+            "emails_stubbed": smtp.sent,
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if regressions and args.fail_on_regression:
+        sys.exit(f"regressions: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
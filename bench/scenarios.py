@@ -0,0 +1,113 @@
+import datetime
+from starlette.concurrency import run_in_threadpool
+from .seed import BENCH_PASSWORD, WORDS, bench_email
+
+# Each scenario is an async callable (client, ctx, i) returning the HTTP status
+# (or None for non-HTTP work). They run in this order, so the write scenarios
+# consume the tasks created by create_task.
+
+class Context:
+    def __init__(self, users: int):
+        self.users = users
+        self.headers = {}
+        self.projects = {}
+        self.created = []
+        self.cursors = {}
+
+    async def setup(self, client, logins: int):
+        for n in range(min(self.users, logins)):
+            r = await client.post("/login", json={"email": bench_email(n), "password": BENCH_PASSWORD})
+            r.raise_for_status()
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            projects = (await client.get("/projects", headers=headers)).json()
+            self.headers[n] = headers
+            self.projects[n] = [p["id"] for p in projects]
+
+    def user(self, i: int):
+        n = i % len(self.headers)
+        return n, self.headers[n]
+
+async def login(client, ctx, i):
+    r = await client.post("/login", json={"email": bench_email(i % ctx.users), "password": BENCH_PASSWORD})
+    return r.status_code
+
+async def list_tasks(client, ctx, i):
+    _, headers = ctx.user(i)
+    return (await client.get("/tasks", params={"limit": 50}, headers=headers)).status_code
+
+async def list_tasks_filtered(client, ctx, i):
+    n, headers = ctx.user(i)
+    params = {"status": "pending", "priority": i % 5 + 1, "project_id": ctx.projects[n][i % len(ctx.projects[n])], "limit": 50}
+    return (await client.get("/tasks", params=params, headers=headers)).status_code
+
+async def list_tasks_paginated(client, ctx, i):
+    # Walks each user's tasks in due-date order, one page per call.
+    n, headers = ctx.user(i)
+    params = {"sort": "due_date", "limit": 50}
+    if ctx.cursors.get(n):
+        params["cursor"] = ctx.cursors[n]
+    r = await client.get("/tasks", params=params, headers=headers)
+    ctx.cursors[n] = r.headers.get("X-Next-Cursor")
+    return r.status_code
+
+async def search_tasks(client, ctx, i):
+    _, headers = ctx.user(i)
+    return (await client.get("/tasks/search", params={"q": WORDS[i % len(WORDS)], "limit": 20}, headers=headers)).status_code
+
+async def project_stats(client, ctx, i):
+    _, headers = ctx.user(i)
+    return (await client.get("/projects/stats", headers=headers)).status_code
+
+def _task_body(ctx, n, i, status="pending"):
+    return {
+        "title": f"bench task {i}",
+        "description": "created by the benchmark suite",
+        "status": status,
+        "priority": i % 5 + 1,
+        "due_date": (datetime.date.today() + datetime.timedelta(days=i % 30 - 15)).isoformat(),
+        "project_id": ctx.projects[n][i % len(ctx.projects[n])],
+    }
+
+async def create_task(client, ctx, i):
+    n, headers = ctx.user(i)
+    r = await client.post("/tasks", json=_task_body(ctx, n, i), headers=headers)
+    if r.status_code == 200:
+        ctx.created.append((n, r.json()["id"]))
+    return r.status_code
+
+async def update_task(client, ctx, i):
+    if not ctx.created:
+        return None
+    n, task_id = ctx.created[i % len(ctx.created)]
+    body = _task_body(ctx, n, i, status=("in_progress", "done")[i % 2])
+    body["assigned_user_id"] = None
+    return (await client.patch(f"/tasks/{task_id}", json=body, headers=ctx.headers[n])).status_code
+
+async def delete_task(client, ctx, i):
+    if not ctx.created:
+        return None
+    n, task_id = ctx.created.pop()
+    return (await client.delete(f"/tasks/{task_id}", headers=ctx.headers[n])).status_code
+
+async def overdue_digest(client, ctx, i):
+    from app.celery_worker import send_daily_overdue_summary
+    await run_in_threadpool(send_daily_overdue_summary.apply)
+
+async def drain_outbox(client, ctx, i):
+    from app.celery_worker import drain_notification_outbox
+    await run_in_threadpool(drain_notification_outbox.apply)
+
+# name -> (scenario, max iterations; None means --requests)
+SCENARIOS = {
+    "login": (login, 50),
+    "list_tasks": (list_tasks, None),
+    "list_tasks_filtered": (list_tasks_filtered, None),
+    "list_tasks_paginated": (list_tasks_paginated, None),
+    "search_tasks": (search_tasks, None),
+    "project_stats": (project_stats, None),
+    "create_task": (create_task, None),
+    "update_task": (update_task, None),
+    "delete_task": (delete_task, None),
+    "drain_outbox": (drain_outbox, 5),
+    "overdue_digest": (overdue_digest, 5),
+}
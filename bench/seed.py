@@ -0,0 +1,84 @@
+import argparse
+import datetime
+import os
+import random
+import time
+
+# Deterministic dataset for the benchmark suite. Run it directly to (re)build a
+# database, or let `python -m bench` seed one on first use.
+BENCH_PASSWORD = "bench-password"
+STATUSES = ("pending", "pending", "in_progress", "in_progress", "done")
+WORDS = (
+    "deploy", "review", "migrate", "invoice", "report", "design", "refactor", "audit", "schedule", "backup",
+    "release", "onboard", "budget", "roadmap", "benchmark", "database", "customer", "security", "payment", "analytics",
+)
+
+def bench_email(n: int):
+    return f"bench{n}@example.com"
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _task_rows(rng, tasks, project_ids, user_ids, today):
+    for i in range(tasks):
+        title = " ".join(rng.sample(WORDS, 3)) + f" #{i}"
+        yield {
+            "title": title,
+            "description": " ".join(rng.choices(WORDS, k=12)) if rng.random() < 0.7 else None,
+            "status": rng.choice(STATUSES),
+            "priority": rng.randint(1, 5),
+            "due_date": today + datetime.timedelta(days=rng.randint(-90, 90)) if rng.random() < 0.8 else None,
+            "project_id": rng.choice(project_ids),
+            "assigned_user_id": rng.choice(user_ids) if rng.random() < 0.5 else None,
+        }
+
+def seed(tasks: int, users: int = None, projects_per_user: int = 10, seed: int = 42, batch_size: int = 10000, log=print):
+    from sqlalchemy import insert, select
+    from app import database, hashing, migrate, models, stats
+
+    users = users or max(1, tasks // 1000)
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    migrate.migrate(database.engine)
+    # Every bench user shares one hash; hashing it per row would dominate seeding.
+    hashed = hashing._hash(BENCH_PASSWORD, hashing.BCRYPT_ROUNDS)
+    started = time.perf_counter()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [{"email": bench_email(n), "hashed_password": hashed} for n in range(users)])
+        user_ids = list(conn.scalars(select(models.User.id).order_by(models.User.id)))
+        conn.execute(insert(models.Project), [
+            {"name": f"project {u}-{p}", "description": None, "owner_id": user_id}
+            for u, user_id in enumerate(user_ids) for p in range(projects_per_user)
+        ])
+        project_ids = list(conn.scalars(select(models.Project.id).order_by(models.Project.id)))
+    done = 0
+    for batch in _batches(_task_rows(rng, tasks, project_ids, user_ids, today), batch_size):
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Task), batch)
+        done += len(batch)
+        log(f"seeded {done}/{tasks} tasks")
+    with database.SessionLocal() as session:
+        stats.reconcile(session)
+    log(f"seeded {users} users, {len(project_ids)} projects, {tasks} tasks in {time.perf_counter() - started:.1f}s")
+    return {"users": users, "projects": len(project_ids), "tasks": tasks, "seed": seed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a benchmark database with users, projects and tasks.")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=None, help="default: one per 1000 tasks")
+    parser.add_argument("--projects-per-user", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    seed(args.tasks, args.users, args.projects_per_user, args.seed, args.batch_size)
@@ -0,0 +1,77 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+
+# Micro-benchmark for the list-endpoint fast path: ORM load + pydantic +
+# JSONResponse versus Core rows + orjson. Also verifies both produce the same
+# bytes, on seeded pages and on edge-case strings, and exits non-zero if not.
+#
+#   python -m bench.serialization --db bench.db --rows 1000 --iterations 50
+
+EDGE_STRINGS = ("plain", "é ü 中文", "quote \" and \\ backslash", "ctrl \x01\x1f\t\n", "  ", "emoji 😀", "<b>&amp;</b>", "")
+
+def legacy_body(objects, schema):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    return JSONResponse(jsonable_encoder([schema.model_validate(obj, from_attributes=True) for obj in objects])).body
+
+def _edge_tasks():
+    from app import models
+    return [
+        models.Task(id=i, title=title, description=title or None, status=title[:3] or None, priority=i if i % 3 else None,
+                    due_date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i) if i % 2 else None, project_id=i, assigned_user_id=None)
+        for i, title in enumerate(EDGE_STRINGS)
+    ]
+
+def _timed(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - started) / iterations, result
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.serialization", description="Compare ORM and Core+orjson list serialization.")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--tasks", type=int, default=10000, help="tasks to seed when the database is created")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per page")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    from . import seed
+    if not os.path.exists(args.db):
+        seed.seed(args.tasks)
+    from sqlalchemy import select
+    from app import database, models, schemas, serialization
+
+    edge = _edge_tasks()
+    edge_rows = [tuple(getattr(t, f) for f in serialization.TASK_OUT_FIELDS) for t in edge]
+    edge_identical = legacy_body(edge, schemas.TaskOut) == serialization.dump_rows(edge_rows, serialization.TASK_OUT_FIELDS)
+    mismatches = int(not edge_identical)
+
+    cases = (
+        ("tasks", models.Task, schemas.TaskOut, serialization.TASK_OUT_COLUMNS, serialization.TASK_OUT_FIELDS),
+        ("projects", models.Project, schemas.ProjectOut, serialization.PROJECT_OUT_COLUMNS, serialization.PROJECT_OUT_FIELDS),
+    )
+    with database.SessionLocal() as db:
+        for name, model, schema, columns, fields in cases:
+            def orm_path():
+                db.expunge_all()
+                return legacy_body(db.scalars(select(model).order_by(model.id).limit(args.rows)).all(), schema)
+
+            def fast_path():
+                return serialization.dump_rows(db.execute(select(*columns).order_by(model.id).limit(args.rows)).all(), fields)
+
+            orm_time, orm_bytes = _timed(orm_path, args.iterations)
+            fast_time, fast_bytes = _timed(fast_path, args.iterations)
+            identical = orm_bytes == fast_bytes
+            mismatches += not identical
+            print(f"{name:<9} rows={args.rows} orm+pydantic={orm_time * 1000:.2f}ms core+orjson={fast_time * 1000:.2f}ms "
+                  f"speedup={orm_time / fast_time:.1f}x identical={identical}")
+    print(f"edge-case strings identical={edge_identical}")
+    if mismatches:
+        sys.exit("fast path output differs from the response-model output")
+
+if __name__ == "__main__":
+    main()
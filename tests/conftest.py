@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Settings are read when app modules are imported, so point them at throwaway
+# local backends before any test imports app.
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/task_manager_tests.db")
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_BACKEND_URL", "cache+memory://")
+os.environ.pop("CACHE_REDIS_URL", None)
+os.environ.pop("EVENTS_REDIS_URL", None)
@@ -0,0 +1,28 @@
+import re
+from datetime import date
+from sqlalchemy.dialects import postgresql
+from app import crud
+
+# SQLite accepts untyped parameters and NULLs anywhere; asyncpg does not. These
+# compile the bulk statements the way production Postgres receives them.
+
+def _postgres_sql(stmt):
+    return str(stmt.compile(dialect=postgresql.asyncpg.dialect()))
+
+def _values_clause(sql):
+    return re.search(r"\(VALUES (.*?)\)\)", sql, re.S).group(1)
+
+def _task(task_id, **fields):
+    row = {"id": task_id, "version": 1, "title": "t", "description": None, "status": "pending",
+           "priority": None, "due_date": None, "assigned_user_id": None}
+    return dict(row, **fields)
+
+def test_bulk_update_types_all_null_columns():
+    sql = _postgres_sql(crud.bulk_update_statement(1, [_task(1), _task(2)]))
+    values = _values_clause(sql)
+    assert "NULL" not in values
+    assert "::DATE" in values and "::INTEGER" in values
+
+def test_bulk_update_types_mixed_columns():
+    sql = _postgres_sql(crud.bulk_update_statement(1, [_task(1, priority=3, due_date=date(2030, 1, 1)), _task(2)]))
+    assert "NULL" not in _values_clause(sql)
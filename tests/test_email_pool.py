@@ -0,0 +1,124 @@
+import smtplib
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+from app import email_utils
+
+# A local aiosmtpd server stands in for the SMTP relay. Each client connection
+# comes from its own port, which is how connection reuse is observed.
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session.peer[1], envelope.rcpt_tos[0]))
+        return "250 Message accepted"
+
+    @property
+    def connections(self):
+        return len({port for port, _ in self.messages})
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    handler = RecordingHandler()
+    port = _free_port()
+
+    def start():
+        controller = Controller(handler, hostname="127.0.0.1", port=port, auth_require_tls=False,
+                                authenticator=lambda *args: AuthResult(success=True))
+        controller.start()
+        return controller
+
+    monkeypatch.setattr(email_utils, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(email_utils, "SMTP_PORT", port)
+    monkeypatch.setattr(email_utils, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email_utils, "SMTP_USER", "app@example.com")
+    monkeypatch.setattr(email_utils, "SMTP_PASSWORD", "secret")
+    monkeypatch.setattr(email_utils, "SMTP_TIMEOUT", 5)
+    server = {"handler": handler, "controller": start(), "start": start}
+    yield server
+    server["controller"].stop()
+
+@pytest.fixture
+def pool():
+    pool = email_utils.SMTPConnectionPool(size=2)
+    yield pool
+    pool.close()
+
+def _messages(*recipients):
+    return [email_utils.build_message(to, "Subject", "Body") for to in recipients]
+
+def _restart(server):
+    # Drops every open session, as a relay restart or idle timeout would.
+    server["controller"].stop()
+    server["controller"] = server["start"]()
+
+def test_reuses_connection_across_batches(smtp_server, pool):
+    assert pool.send_messages(_messages("a@example.com", "b@example.com")) == []
+    assert pool.send_messages(_messages("c@example.com")) == []
+    assert [to for _, to in smtp_server["handler"].messages] == ["a@example.com", "b@example.com", "c@example.com"]
+    assert smtp_server["handler"].connections == 1
+
+def test_rotates_connection_after_max_messages(smtp_server, pool, monkeypatch):
+    monkeypatch.setattr(email_utils, "SMTP_MAX_MESSAGES_PER_CONNECTION", 2)
+    pool.send_messages(_messages(*(f"user{i}@example.com" for i in range(5))))
+    assert len(smtp_server["handler"].messages) == 5
+    assert smtp_server["handler"].connections == 3
+
+def test_noop_probe_replaces_dead_idle_connection(smtp_server, pool, monkeypatch):
+    pool.send_messages(_messages("a@example.com"))
+    _restart(smtp_server)
+    monkeypatch.setattr(email_utils, "SMTP_NOOP_INTERVAL", 0)
+    noops = []
+    real_noop = smtplib.SMTP.noop
+    monkeypatch.setattr(smtplib.SMTP, "noop", lambda self: noops.append(1) or real_noop(self))
+    assert pool.send_messages(_messages("b@example.com")) == []
+    assert noops
+    assert smtp_server["handler"].connections == 2
+
+def test_retries_once_on_disconnect(smtp_server, pool):
+    pool.send_messages(_messages("a@example.com"))
+    _restart(smtp_server)
+    # Fresh enough to skip the NOOP probe, so the send itself hits the dead session.
+    assert pool.send_messages(_messages("b@example.com", "c@example.com")) == []
+    assert [to for _, to in smtp_server["handler"].messages] == ["a@example.com", "b@example.com", "c@example.com"]
+    assert smtp_server["handler"].connections == 2
+
+def test_second_connection_failure_aborts_batch(smtp_server, pool, monkeypatch):
+    monkeypatch.setattr(smtplib.SMTP, "send_message", lambda *args, **kwargs: (_ for _ in ()).throw(smtplib.SMTPServerDisconnected()))
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        pool.send_messages(_messages("a@example.com"))
+    # The broken connection gave its slot back.
+    assert pool._slots.acquire(timeout=0) and pool._slots.acquire(timeout=0)
+
+def test_refused_recipients_are_returned_and_batch_continues(smtp_server, pool):
+    refused = pool.send_messages(_messages("a@example.com", "refused@example.com", "b@example.com"))
+    assert [msg["To"] for msg, _ in refused] == ["refused@example.com"]
+    assert isinstance(refused[0][1], smtplib.SMTPRecipientsRefused)
+    assert [to for _, to in smtp_server["handler"].messages] == ["a@example.com", "b@example.com"]
+
+def test_refusal_on_retried_send_is_returned(smtp_server, pool):
+    pool.send_messages(_messages("a@example.com"))
+    _restart(smtp_server)
+    refused = pool.send_messages(_messages("refused@example.com", "b@example.com"))
+    assert [msg["To"] for msg, _ in refused] == ["refused@example.com"]
+    assert [to for _, to in smtp_server["handler"].messages] == ["a@example.com", "b@example.com"]
+
+def test_send_email_smtp_raises_on_refusal(smtp_server, pool, monkeypatch):
+    monkeypatch.setattr(email_utils, "_pool", pool)
+    email_utils.send_email_smtp("a@example.com", "Subject", "Body")
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        email_utils.send_email_smtp("refused@example.com", "Subject", "Body")
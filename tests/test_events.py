@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from app import events
+
+# The feed over the in-process broker: events.stream is driven directly, one
+# SSE frame per step, the way StreamingResponse pulls it.
+
+PROJECT = 7
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = events.MemoryBroker()
+    monkeypatch.setattr(events, "broker", broker)
+    return broker
+
+def _parse(frame: bytes):
+    fields = dict(line.split(": ", 1) for line in frame.decode().strip().split("\n"))
+    return fields.get("id"), fields.get("event"), fields.get("data")
+
+async def _publish(*types, project_id=PROJECT):
+    await events.publish([(project_id, type_, {"n": i}) for i, type_ in enumerate(types)])
+
+async def _open(last_event_id=None):
+    stream = events.stream(PROJECT, last_event_id)
+    assert (await stream.__anext__()).startswith(b"retry: ")
+    return stream
+
+async def _next(stream, pending=None):
+    # Starts the next step, lets it subscribe and wait, then runs pending publishes.
+    step = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    if pending:
+        await pending
+    return _parse(await asyncio.wait_for(step, 1))
+
+def test_streams_live_events_in_order(broker):
+    async def run():
+        stream = await _open()
+        first = await _next(stream, _publish("task.created", "task.updated"))
+        second = await _next(stream)
+        await stream.aclose()
+        return first, second
+    first, second = asyncio.run(run())
+    assert first == ("1", "task.created", '{"n":0}')
+    assert second == ("2", "task.updated", '{"n":1}')
+    assert not broker._subscriptions
+
+def test_other_projects_are_not_delivered(broker):
+    async def run():
+        stream = await _open()
+        frame = await _next(stream, _publish("task.created", project_id=PROJECT + 1))
+        return frame
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+
+def test_last_event_id_replays_missed_events(broker):
+    async def run():
+        await _publish("task.created", "task.updated", "task.deleted")
+        stream = await _open(last_event_id="1")
+        frames = [await _next(stream), await _next(stream)]
+        frames.append(await _next(stream, _publish("task.created")))
+        await stream.aclose()
+        return frames
+    assert [(i, t) for i, t, _ in asyncio.run(run())] == [("2", "task.updated"), ("3", "task.deleted"), ("4", "task.created")]
+
+def test_trimmed_last_event_id_sends_reset(broker, monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_REPLAY_SIZE", 2)
+    async def run():
+        await _publish("task.created", "task.updated", "task.deleted")
+        stream = await _open(last_event_id="1")
+        reset = await _next(stream)
+        live = await _next(stream, _publish("task.created"))
+        await stream.aclose()
+        return reset, live
+    reset, live = asyncio.run(run())
+    # The reset carries the newest buffered id, so a reconnect resumes after it.
+    assert reset == ("3", "reset", "{}")
+    assert live[:2] == ("4", "task.created")
+
+def test_unknown_last_event_id_sends_reset_without_id(broker):
+    async def run():
+        stream = await _open(last_event_id="99")
+        frame = await _next(stream)
+        await stream.aclose()
+        return frame
+    assert asyncio.run(run()) == ("", "reset", "{}")
+
+def test_slow_consumer_is_disconnected_and_resumes(broker, monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 2)
+    async def run():
+        stream = await _open()
+        first = await _next(stream, _publish("task.created"))
+        # Falls three events behind with room for two: the backlog is dropped and the stream ends.
+        await _publish("a", "b", "c")
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        resumed = await _open(last_event_id=first[0])
+        frames = [await _next(resumed) for _ in range(3)]
+        await resumed.aclose()
+        return frames
+    assert [t for _, t, _ in asyncio.run(run())] == ["a", "b", "c"]
+    assert not broker._subscriptions
+
+def test_project_deleted_ends_stream(broker):
+    async def run():
+        stream = await _open()
+        frame = await _next(stream, _publish("project.deleted"))
+        with pytest.raises(StopAsyncIteration):
+            await stream.__anext__()
+        return frame
+    assert asyncio.run(run())[1] == "project.deleted"
+
+def test_keepalive_while_idle(broker, monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_KEEPALIVE", 0.01)
+    async def run():
+        stream = await _open()
+        frame = await asyncio.wait_for(stream.__anext__(), 1)
+        await stream.aclose()
+        return frame
+    assert asyncio.run(run()) == b": keepalive\n\n"
+
+def test_idle_buffers_are_evicted_once_unwatched(broker, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(events.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(events, "EVENTS_REPLAY_TTL", 60)
+    async def run():
+        await _publish("task.created", project_id=1)
+        subscription = await broker.subscribe(2)
+        await _publish("task.created", project_id=2)
+        clock[0] += 61
+        await _publish("task.created", project_id=3)
+        # Project 1 aged out; project 2 is kept while someone listens.
+        assert set(broker._buffers) == {2, 3}
+        broker.unsubscribe(subscription)
+        assert set(broker._buffers) == {3}
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+from datetime import timedelta
+import pytest
+from sqlalchemy import delete, insert, select
+from app import database, email_utils, migrate, models, outbox
+
+@pytest.fixture
+def db(monkeypatch):
+    migrate.migrate(database.engine)
+    session = database.SessionLocal()
+    session.execute(delete(models.NotificationOutbox))
+    session.execute(delete(models.User).where(models.User.email.like("%@outbox.test")))
+    user_id = session.execute(insert(models.User).values(email="a@outbox.test", hashed_password="x").returning(models.User.id)).scalar()
+    session.execute(insert(models.NotificationOutbox), [
+        {"recipient_id": user_id, "task_id": i, "kind": "assigned", "task_title": f"Task {i}", "status": "todo"} for i in range(3)
+    ])
+    session.commit()
+    sent = []
+    monkeypatch.setattr(email_utils, "send_email_batch", lambda messages: sent.extend(messages) or [])
+    yield session, sent
+    session.close()
+
+def _later():
+    return models._utcnow() + timedelta(seconds=outbox.OUTBOX_COALESCE_WINDOW + 1)
+
+class _Interleaved:
+    # Runs another drain right after this one has picked its candidate rows and
+    # before it claims them, the window SKIP LOCKED would close on Postgres.
+    def __init__(self, session, other):
+        self.session, self.other, self.calls = session, other, 0
+
+    def execute(self, *args, **kwargs):
+        result = self.session.execute(*args, **kwargs)
+        self.calls += 1
+        if self.calls == 1:
+            self.other()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+def test_drain_coalesces_and_marks_sent(db):
+    session, sent = db
+    assert outbox.drain(session, _later()) == 3
+    assert [(to, subject) for to, subject, _, _ in sent] == [("a@outbox.test", "3 task updates")]
+    assert outbox.drain(session, _later()) == 0
+    assert session.execute(select(models.NotificationOutbox.sent_at.is_not(None))).scalars().all() == [True] * 3
+
+def test_overlapping_drains_send_each_event_once(db):
+    session, sent = db
+    other = database.SessionLocal()
+    counts = []
+    drained = outbox.drain(_Interleaved(session, lambda: counts.append(outbox.drain(other, _later()))), _later())
+    other.close()
+    assert sorted([drained, *counts]) == [0, 3]
+    assert len(sent) == 1
+
+def test_expired_claim_is_retried_with_same_key(db, monkeypatch):
+    session, sent = db
+    monkeypatch.setattr(email_utils, "send_email_batch", lambda messages: (_ for _ in ()).throw(ConnectionError()))
+    with pytest.raises(ConnectionError):
+        outbox.drain(session, _later())
+    session.rollback()
+    monkeypatch.setattr(email_utils, "send_email_batch", lambda messages: sent.extend(messages) or [])
+    assert outbox.drain(session, _later()) == 0
+    assert outbox.drain(session, _later() + timedelta(seconds=outbox.OUTBOX_CLAIM_TIMEOUT + 1)) == 3
+    keys = session.execute(select(models.NotificationOutbox.delivery_key).distinct()).scalars().all()
+    assert [key for _, _, _, key in sent] == keys
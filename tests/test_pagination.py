@@ -0,0 +1,27 @@
+import base64
+import json
+from datetime import date
+import pytest
+from app import pagination
+
+def _raw_cursor(*parts):
+    return base64.urlsafe_b64encode(json.dumps(list(parts)).encode()).decode().rstrip("=")
+
+@pytest.mark.parametrize("sort, key", [("id", None), ("priority", 3), ("priority", None), ("due_date", date(2030, 1, 2)), ("due_date", None)])
+def test_round_trip(sort, key):
+    assert pagination.decode_cursor(pagination.encode_cursor(sort, key, 7), sort) == (key, 7)
+
+@pytest.mark.parametrize("cursor, sort", [
+    ("not base64!", "id"),
+    (_raw_cursor("id", None, 7), "priority"),
+    (_raw_cursor("id", None, "7"), "id"),
+    (_raw_cursor("priority", "3", 7), "priority"),
+    (_raw_cursor("priority", True, 7), "priority"),
+    (_raw_cursor("priority", 1.5, 7), "priority"),
+    (_raw_cursor("due_date", "tomorrow", 7), "due_date"),
+    (_raw_cursor("due_date", 20300102, 7), "due_date"),
+    (_raw_cursor("rank", "x", 7), "rank"),
+])
+def test_tampered_cursor_is_rejected(cursor, sort):
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor(cursor, sort)
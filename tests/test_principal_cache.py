@@ -0,0 +1,53 @@
+import asyncio
+import fakeredis
+import pytest
+from app import auth, cache
+
+# Two workers share one Redis; each keeps its own in-process principal cache.
+# Here the local cache belongs to "this" worker and invalidations arrive from
+# another one over pub/sub.
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "CACHE_REDIS_URL", "redis://fake")
+    monkeypatch.setattr(cache, "_async_redis_client", fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(auth, "_invalidations", fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(auth, "_invalidation_listener", None)
+    auth._principal_cache.clear()
+    yield server
+    auth._principal_cache.clear()
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+async def _cached(user_id, email):
+    await auth._cache_principal(user_id, email)
+    await _settle()
+    # Cached after the listener subscribed, so no invalidation can be missed from here on.
+    await auth._cache_principal(user_id, email)
+
+def test_invalidation_from_another_worker_drops_local_copy(redis_server):
+    async def run():
+        await _cached(1, "a@example.com")
+        await _cached(2, "b@example.com")
+        other_worker = fakeredis.FakeAsyncRedis(server=redis_server)
+        await other_worker.publish(auth.PRINCIPAL_CHANNEL, 1)
+        await _settle()
+        result = auth._principal_cache.get(1), auth._principal_cache.get(2)
+        auth._invalidation_listener.cancel()
+        return result
+    dropped, kept = asyncio.run(run())
+    assert dropped is None
+    assert kept.email == "b@example.com"
+
+def test_invalidate_principal_clears_every_tier(redis_server):
+    async def run():
+        await _cached(1, "a@example.com")
+        await auth.invalidate_principal(1)
+        await _settle()
+        shared = await cache.redis_get(auth._principal_key(1))
+        auth._invalidation_listener.cancel()
+        return auth._principal_cache.get(1), shared
+    assert asyncio.run(run()) == (None, None)
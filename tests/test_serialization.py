@@ -0,0 +1,34 @@
+from datetime import date
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app import models, schemas, serialization
+
+# The list endpoints serve Core rows through orjson instead of response_model
+# validation; clients must not be able to tell the difference.
+
+TITLES = ["plain", "é ü 中文", 'quote " and \\ backslash', "ctrl \x01\x1f\t\n", "emoji 😀", "<b>&amp;</b>", ""]
+
+def _response_model_body(objects, schema):
+    return JSONResponse(jsonable_encoder([schema.model_validate(obj, from_attributes=True) for obj in objects])).body
+
+def _rows(objects, fields):
+    return [tuple(getattr(obj, field) for field in fields) for obj in objects]
+
+def test_task_rows_match_response_model():
+    tasks = [
+        models.Task(id=i + 1, title=title, description=title or None, status=title[:4] or None,
+                    priority=i if i % 3 else None, due_date=date(2024, 2, 28 + i % 2) if i % 2 else None,
+                    project_id=i + 10, assigned_user_id=i if i % 2 else None)
+        for i, title in enumerate(TITLES)
+    ]
+    response = serialization.rows_response(_rows(tasks, serialization.TASK_OUT_FIELDS), serialization.TASK_OUT_FIELDS)
+    assert response.body == _response_model_body(tasks, schemas.TaskOut)
+    assert response.media_type == "application/json"
+
+def test_project_rows_match_response_model():
+    projects = [models.Project(id=i + 1, name=title, description=None if i % 2 else title, owner_id=i) for i, title in enumerate(TITLES)]
+    body = serialization.dump_rows(_rows(projects, serialization.PROJECT_OUT_FIELDS), serialization.PROJECT_OUT_FIELDS)
+    assert body == _response_model_body(projects, schemas.ProjectOut)
+
+def test_empty_list():
+    assert serialization.dump_rows([], serialization.TASK_OUT_FIELDS) == _response_model_body([], schemas.TaskOut)